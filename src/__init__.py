@@ -1,3 +1,8 @@
+import time
+
+# Start of the add-on initialization, see "Startup time" below
+_time_start_init = time.perf_counter()
+
 from aqt import appVersion
 
 required_anki_version = (23, 10, 0)
@@ -7,6 +12,9 @@ if anki_version < required_anki_version:
         f"Minimum Anki version supported: {required_anki_version[0]}.{required_anki_version[1]}.{required_anki_version[2]}"
     )
 
+from typing import Optional
+
+from anki.collection import OpChanges
 from aqt import gui_hooks, mw
 from aqt.errors import show_exception
 from aqt.qt import QAction, qconnect
@@ -20,22 +28,63 @@ from . import (
     logger,
     models,
     puller,
+    puller_cookie_collection,
     puller_cookie_replicache,
+    puller_rembs_cleared,
+    quarantine_rembs,
+    session_http,
     user_files,
     users,
 )
 
 #: Init
 
+# The user files, the logger and the services built on them are created when the
+# first profile opens, not when Anki loads the add-on before the profile, so
+# that loading the add-on doesn't read the user files, write the version key or
+# start the thread of the logger, see `init`
+_user_files: user_files.UserFiles
+_logger: logger.Logger
+_cookie_replicache: puller_cookie_replicache.CookieReplicache
+_rembs_cleared: puller_rembs_cleared.RembsCleared
+# Rembs that failed to import, see `Notes._quarantine_remb`
+_quarantine_rembs: quarantine_rembs.QuarantineRembs
+_auth: auth.Auth
+_puller: puller.Puller
+_is_initialized = False
+
+
+def init() -> None:
+    global _user_files, _logger, _cookie_replicache, _rembs_cleared
+    global _quarantine_rembs, _auth, _puller, _is_initialized
+    if _is_initialized:
+        return
+    time_start = time.perf_counter()
+
+    _user_files = user_files.UserFiles()
+    # Written only when the add-on version changed, see `UserFiles.set`
+    _user_files.set("version_rember_anki_sync", info.VERSION_REMBER_ANKI_SYNC)
+    _logger = logger.Logger(user_files=_user_files)
+
+    _cookie_replicache = puller_cookie_replicache.CookieReplicache(
+        user_files=_user_files, callback_set=_logger.set_cookie_replicache
+    )
+    _rembs_cleared = puller_rembs_cleared.RembsCleared(user_files=_user_files)
+    _quarantine_rembs = quarantine_rembs.QuarantineRembs(user_files=_user_files)
+
+    _auth = auth.Auth(mw=mw, callback_state_auth=callback_state_auth, logger=_logger)
+    _puller = puller.Puller(mw=mw, auth=_auth, user_files=_user_files, logger=_logger)
+    _is_initialized = True
 
-_user_files = user_files.UserFiles()
-_user_files.set("version_rember_anki_sync", info.VERSION_REMBER_ANKI_SYNC)
-_cookie_replicache = puller_cookie_replicache.CookieReplicache(user_files=_user_files)
+    # Log plugin initialization, see "Startup time" below
+    _logger.info(
+        f"Plugin initialized in {(time.perf_counter() - time_start) * 1000:.1f}ms, loaded in {_duration_load * 1000:.1f}ms",
+        mw,
+    )
 
-_logger = logger.Logger(user_files=_user_files)
 
-# Log plugin initialization
-_logger.info(f"Plugin initialized", mw)
+# Runs before the other hooks of the add-on on `profile_did_open`
+gui_hooks.profile_did_open.append(init)
 
 # Allow access to app-anki files to the webviews
 # REFS: https://addon-docs.ankiweb.net/hooks-and-filters.html#managing-external-resources-in-webviews
@@ -47,6 +96,9 @@ def on_load(_) -> None:
     if mw.col is None:
         raise RuntimeError("Collection is None")
 
+    # The cached ids belong to the previous collection
+    clear_cache_rember()
+
     _models = models.Models(col=mw.col)
     _decks = decks.Decks(col=mw.col)
     _models.create_media_app_anki()
@@ -56,6 +108,23 @@ def on_load(_) -> None:
 
 gui_hooks.collection_did_load.append(on_load)
 
+
+# The ids of the Rember model and deck are cached, clear them when the collection
+# is loaded, see `on_load`, or when its models or decks change. Pulls update the
+# collection outside of operations, which don't fire the hook, but they never
+# change the ids.
+def clear_cache_rember() -> None:
+    models.clear_cache_model_rember()
+    decks.clear_cache_deck_rember()
+
+
+def on_operation_did_execute(changes: OpChanges, handler: Optional[object]) -> None:
+    if changes.notetype or changes.deck:
+        clear_cache_rember()
+
+
+gui_hooks.operation_did_execute.append(on_operation_did_execute)
+
 #: Rember menu
 
 action_auth = QAction("Sign in")
@@ -82,6 +151,10 @@ if mw.pm is not None:
 
 
 def callback_state_auth(state: auth.StateAuth) -> None:
+    _logger.set_token_access(
+        state.tokens.access if state._tag == "SignedIn" else None
+    )
+
     if state._tag == "LoggedOut":
         action_auth.setText("Sign in")
         action_import_rember_data.setEnabled(False)
@@ -89,6 +162,10 @@ def callback_state_auth(state: auth.StateAuth) -> None:
         # user signs in
         _cookie_replicache.reset()
         _logger.info("Cookie replicache reset, reason: user logged out", mw)
+        # The rembs cleared or quarantined by the pulls of this user must not be
+        # deleted or retried in the pulls of the next one
+        _rembs_cleared.reset()
+        _quarantine_rembs.reset()
 
     if state._tag == "SigningIn":
         action_auth.setText("Cancel sign-in")
@@ -99,9 +176,6 @@ def callback_state_auth(state: auth.StateAuth) -> None:
         action_import_rember_data.setEnabled(True)
 
 
-_auth = auth.Auth(mw=mw, callback_state_auth=callback_state_auth, logger=_logger)
-
-
 def refresh_auth() -> None:
     if mw.pm is None:
         raise RuntimeError("ProfileManager not defined")
@@ -119,14 +193,31 @@ def close_auth() -> None:
 gui_hooks.profile_did_open.append(refresh_auth)
 gui_hooks.profile_will_close.append(close_auth)
 
+#: HTTP session
+
+gui_hooks.profile_will_close.append(session_http.close_session)
+
 #: Puller
 
-_puller = puller.Puller(mw=mw, auth=_auth, user_files=_user_files, logger=_logger)
 
 # WARN: We want to pull from Rember before syncing, so that the changes are
 # are synced. In order for this to work as we expect, we rely on background
 # operations that access collection being serialized in Anki.
-gui_hooks.sync_will_start.append(_puller.pull)
+def on_sync_will_start() -> None:
+    _puller.pull()
+
+
+gui_hooks.sync_will_start.append(on_sync_will_start)
+
+
+# A full sync that downloaded the collection from AnkiWeb discards the notes
+# pulled since the last upload, the cookie is restored from the collection, see
+# `CookieCollection`
+def on_sync_did_finish() -> None:
+    _puller.restore_cookie_from_collection()
+
+
+gui_hooks.sync_did_finish.append(on_sync_did_finish)
 
 
 #: Action triggers
@@ -178,11 +269,20 @@ def on_action_status() -> None:
     _users = users.Users(user_files=_user_files)
     email = _users.get_email_user(id_user=result_decode_token_access.payload.id_user)
 
+    cnt_rembs_quarantined = _quarantine_rembs.count()
+    info_quarantine = (
+        f"\n\n{cnt_rembs_quarantined} rembs could not be imported, they will be retried on the next sync. Updating the add-on might fix the issue."
+        if cnt_rembs_quarantined > 0
+        else ""
+    )
+
     if email is None:
-        showInfo('Signed in, press the "Sync" button to sync Rember data.')
+        showInfo(
+            f'Signed in, press the "Sync" button to sync Rember data.{info_quarantine}'
+        )
         return
 
-    showInfo(f"Signed in as {email}")
+    showInfo(f"Signed in as {email}{info_quarantine}")
 
 
 qconnect(action_status.triggered, on_action_status)
@@ -203,6 +303,8 @@ def on_action_import_rember_data() -> None:
 
     # Clear cookie_replicache, so that we pull from scratch when the user imports manually
     _cookie_replicache.reset()
+    if mw.col is not None:
+        puller_cookie_collection.CookieCollection(col=mw.col).reset()
     _logger.info("Cookie replicache reset, reason: manual import started", mw)
 
     # Pull
@@ -220,3 +322,10 @@ def on_action_help() -> None:
 
 
 qconnect(action_help.triggered, on_action_help)
+
+#: Startup time
+
+# Time spent importing the add-on when Anki starts, logged by `init` together
+# with the time spent initializing it, so that the cost the add-on adds to
+# Anki's launch can be tracked in rember.log
+_duration_load = time.perf_counter() - _time_start_init
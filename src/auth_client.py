@@ -5,9 +5,7 @@ import time
 import urllib.parse
 from typing import Literal, Optional, Union
 
-import requests
-
-from . import auth_tokens, info
+from . import auth_tokens, info, session_http
 
 #: Shared
 
@@ -112,7 +110,9 @@ def exchange(code: str, redirect_uri: str, verifier: str) -> ResultExchange:
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-    response = requests.post(ENDPOINT_TOKEN, data=payload, headers=headers)
+    response = session_http.get_session().post(
+        ENDPOINT_TOKEN, data=payload, headers=headers, timeout=session_http.TIMEOUT
+    )
 
     if response.ok:
         data = response.json()
@@ -160,7 +160,9 @@ def refresh(token_refresh: str, token_access: Optional[str] = None) -> ResultRef
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-    response = requests.post(ENDPOINT_TOKEN, data=payload, headers=headers)
+    response = session_http.get_session().post(
+        ENDPOINT_TOKEN, data=payload, headers=headers, timeout=session_http.TIMEOUT
+    )
 
     if response.ok:
         data = response.json()
@@ -1,9 +1,23 @@
-from anki import collection
+from typing import Optional
+
+from anki import collection, decks
 
 #:
 
 NAME_DECK_REMBER = "Rember"
 
+#: Cache
+
+# Id of the Rember deck in the open collection, cleared by the collection hooks
+# registered in `__init__.py`, see `clear_cache_deck_rember`
+_id_deck_rember_cached: Optional[int] = None
+
+
+def clear_cache_deck_rember() -> None:
+    global _id_deck_rember_cached
+    _id_deck_rember_cached = None
+
+
 #:
 
 
@@ -39,3 +53,13 @@ class Decks:
         if deck is None:
             raise RuntimeError("Rember deck not found")
         return deck
+
+    ##: get_id_deck_rember
+
+    def get_id_deck_rember(self) -> decks.DeckId:
+        """Same as `get_deck_rember()["id"]`, cached until the decks change."""
+        global _id_deck_rember_cached
+
+        if _id_deck_rember_cached is None:
+            _id_deck_rember_cached = self.get_deck_rember()["id"]
+        return decks.DeckId(_id_deck_rember_cached)
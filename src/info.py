@@ -1,2 +1,2 @@
-VERSION_REMBER_ANKI_SYNC = "0.1.3"
+VERSION_REMBER_ANKI_SYNC = "0.2.0"
 SITE_REMBER = "rember.com"
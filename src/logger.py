@@ -1,11 +1,36 @@
+import atexit
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 from typing import Optional
 
 from aqt.main import AnkiQt
 
 from . import auth_tokens, info, user_files
 
+#: Constants
+
+SIZE_MAX_FILE_LOG = 1024 * 1024
+COUNT_BACKUP_FILE_LOG = 5
+# Compress rotated log files with gzip, rember.log.1.gz, rember.log.2.gz, ...
+COMPRESS_BACKUP_FILE_LOG = True
+
+#: Rotation
+
+
+def _name_backup_file_log(name: str) -> str:
+    return f"{name}.gz"
+
+
+def _rotate_file_log(source: str, dest: str) -> None:
+    with open(source, "rb") as file_source, gzip.open(dest, "wb") as file_dest:
+        shutil.copyfileobj(file_source, file_dest)
+    os.remove(source)
+
+
 #:
 
 
@@ -13,9 +38,14 @@ class Logger:
     def __init__(self, user_files: user_files.UserFiles):
         self._user_files = user_files
         self._setup_logger()
+        self._init_context()
 
     def _setup_logger(self) -> None:
-        """Set up the logger to write to rember.log in the user_files directory."""
+        """
+        Set up the logger to write to rember.log in the user_files directory.
+        Records are put in a queue and written to file by a background thread, so
+        that logging doesn't block the caller, e.g. Qt's main thread, on disk.
+        """
         # Get the user_files directory path
         path_addon = os.path.dirname(os.path.realpath(__file__))
         path_user_files = os.path.join(path_addon, "user_files")
@@ -28,9 +58,19 @@ class Logger:
         # Clear existing handlers to avoid duplicates
         self._logger.handlers.clear()
 
-        # Create file handler
-        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        # Create file handler, rotating rember.log once it reaches the max size
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=SIZE_MAX_FILE_LOG,
+            backupCount=COUNT_BACKUP_FILE_LOG,
+            encoding="utf-8",
+            # Open the file on the first record, in the background thread
+            delay=True,
+        )
         file_handler.setLevel(logging.INFO)
+        if COMPRESS_BACKUP_FILE_LOG:
+            file_handler.namer = _name_backup_file_log
+            file_handler.rotator = _rotate_file_log
 
         # Create formatter
         formatter = logging.Formatter(
@@ -38,40 +78,78 @@ class Logger:
         )
         file_handler.setFormatter(formatter)
 
+        # Create the listener writing the queued records to file
+        queue_records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(
+            queue_records, file_handler, respect_handler_level=True
+        )
+        self._listener.start()
+        self._is_listener_started = True
+        # Write the records still in the queue when Anki exits
+        atexit.register(self.close)
+
         # Add handler to logger
-        self._logger.addHandler(file_handler)
+        self._logger.addHandler(logging.handlers.QueueHandler(queue_records))
+
+    def close(self) -> None:
+        """Write the queued records to file and stop the background thread."""
+        if not self._is_listener_started:
+            return
+        self._listener.stop()
+        self._is_listener_started = False
+        for handler in self._listener.handlers:
+            handler.close()
+
+    ##: Context
+
+    # The context is cached, so that logging doesn't decode the access token or
+    # read the user files. It's updated through `set_token_access`, called when
+    # the auth state changes, and `set_cookie_replicache`, called by
+    # `CookieReplicache.set`.
+
+    def _init_context(self) -> None:
+        self._id_user: Optional[str] = None
+        self._cookie_replicache: Optional[int] = None
+        try:
+            self._cookie_replicache = self._user_files.get("cookie_replicache")
+        except Exception:
+            # Don't let context gathering fail the logging
+            pass
+        self._update_context()
 
-    def _get_context_info(self, mw: Optional[AnkiQt] = None) -> str:
-        """Get context information like user ID and cookie replicache."""
+    def _update_context(self) -> None:
         context_parts = []
 
         # Add version
         context_parts.append(f"v{info.VERSION_REMBER_ANKI_SYNC}")
 
-        # Try to get user ID from tokens
-        if mw and mw.pm:
-            try:
-                tokens = auth_tokens.get_tokens(mw.pm)
-                if tokens:
-                    result_decode = auth_tokens.decode_token_access(tokens.access)
-                    if result_decode._tag == "Success":
-                        context_parts.append(f"user_id={result_decode.payload.id_user}")
-            except Exception:
-                # Don't let context gathering fail the logging
-                pass
+        # Add user ID
+        if self._id_user is not None:
+            context_parts.append(f"user_id={self._id_user}")
 
         # Add cookie replicache
-        try:
-            cookie = self._user_files.get("cookie_replicache")
-            if cookie is not None:
-                context_parts.append(f"cookie_replicache={cookie}")
-            else:
-                context_parts.append("cookie_replicache=None")
-        except Exception:
-            # Don't let context gathering fail the logging
-            pass
+        context_parts.append(f"cookie_replicache={self._cookie_replicache}")
+
+        self._context = f"[{', '.join(context_parts)}]"
+
+    def set_token_access(self, token_access: Optional[str]) -> None:
+        """Set the user ID in the context from the access token, None when signed out."""
+        self._id_user = None
+        if token_access is not None:
+            result_decode = auth_tokens.decode_token_access(token_access)
+            if result_decode._tag == "Success":
+                self._id_user = result_decode.payload.id_user
+        self._update_context()
+
+    def set_cookie_replicache(self, cookie_replicache: Optional[int]) -> None:
+        self._cookie_replicache = cookie_replicache
+        self._update_context()
+
+    def _get_context_info(self, mw: Optional[AnkiQt] = None) -> str:
+        """Get context information like user ID and cookie replicache."""
+        return self._context
 
-        return f"[{', '.join(context_parts)}]" if context_parts else ""
+    ##: Log
 
     def info(self, message: str, mw: Optional[AnkiQt] = None) -> None:
         """Log an info message with context."""
@@ -0,0 +1,60 @@
+import contextlib
+import time
+from typing import Any, Iterable, Iterator, TypeVar
+
+#:
+
+T = TypeVar("T")
+
+
+class Metrics:
+    """
+    Durations and counters of a run, e.g. a pull. Spans and counters with the
+    same name add up, so that a phase repeated for each batch or page is reported
+    once for the whole run.
+    """
+
+    def __init__(self):
+        self._time_start = time.time()
+        self._durations: dict[str, float] = {}
+        self._counters: dict[str, int] = {}
+
+    def add_duration(self, name: str, duration: float) -> None:
+        self._durations[name] = self._durations.get(name, 0.0) + duration
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the block, nested spans are included in the enclosing one."""
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(name, time.perf_counter() - time_start)
+
+    def iter_timed(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Time the production of each item, excluding the time the consumer
+        spends between items, e.g. to decode a patch while it's processed."""
+        iterator = iter(iterable)
+        while True:
+            time_start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_duration(name, time.perf_counter() - time_start)
+                return
+            self.add_duration(name, time.perf_counter() - time_start)
+            yield item
+
+    def count(self, name: str, value: int = 1) -> None:
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def to_record(self) -> dict[str, Any]:
+        """Serializable record of the run, durations are in milliseconds."""
+        return {
+            "time": int(self._time_start),
+            "durations_ms": {
+                name: round(duration * 1000, 1)
+                for name, duration in self._durations.items()
+            },
+            "counters": dict(self._counters),
+        }
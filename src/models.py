@@ -2,7 +2,9 @@
 # used to generate cards from rembs imported from Rember.com. The model is created when
 # the add-on loads and contains fields for storing remb data and templates that determine
 # how cards are displayed during review.
+import hashlib
 import os
+from typing import Optional
 
 from anki import collection, models
 
@@ -10,7 +12,11 @@ from anki import collection, models
 
 # The version in the model name matches the addon version in which the model was
 # introduced.
-NAME_MODEL_REMBER = "Rember 0.1.0"
+NAME_MODEL_REMBER = "Rember 0.2.0"
+# Models created by previous versions of the add-on. If one exists in the
+# collection, it keeps being used instead of creating the current model, see
+# `Models.get_model_rember`. "Rember 0.1.0" has `CNT_MAX_ANKI_CARDS` templates.
+NAMES_MODEL_REMBER_LEGACY = ["Rember 0.1.0"]
 
 # Files for @rember/app-anki, which are copied in the Anki's media folder.
 # File names starting with "_" are special in Anki, they are kept even if no
@@ -22,6 +28,9 @@ NAME_MODEL_REMBER = "Rember 0.1.0"
 # See `create_media_app_anki` below.
 NAME_FILE_SCRIPT_APP_ANKI = "_rember_0_1_0_app_anki.umd.cjs"
 NAME_FILE_CSS_APP_ANKI = "_rember_0_1_0_app_anki.css"
+# Script shared by the templates of the "Rember 0.2.0" model, which loads the
+# files above. The version matches the model, since the templates call it.
+NAME_FILE_LOADER_APP_ANKI = "_rember_0_2_0_loader.js"
 
 NAME_FIELD_LINK = "Link (Do not edit)"
 NAME_FIELD_NOTE = "Note (Do not edit)"
@@ -33,6 +42,22 @@ NAME_TEMPLATE_MODEL_REMBER = lambda ix: f"Card #{ix + 1}"
 
 # See README
 CNT_MAX_ANKI_CARDS = 100
+# The "Rember 0.2.0" model starts with this many "Card" fields and templates, and
+# grows to `CNT_MAX_ANKI_CARDS` the first time a note needs more. See
+# `Models.grow_model_rember`.
+CNT_TEMPLATES_INITIAL = 10
+
+#: Cache
+
+# Id of the Rember model in the open collection, cleared by the collection hooks
+# registered in `__init__.py`, see `clear_cache_model_rember`
+_id_model_rember_cached: Optional[int] = None
+
+
+def clear_cache_model_rember() -> None:
+    global _id_model_rember_cached
+    _id_model_rember_cached = None
+
 
 #:
 
@@ -47,8 +72,13 @@ class Models:
         is HTML, therefore we can use it to inject the app-anki Svelte component in
         the page.
 
-        The template is repeated `CNT_MAX_ANKI_CARDS` times in the user collection,
-        which is not ideal.
+        The template is repeated for each "Card" field in the user collection,
+        therefore it only passes the note fields to the loader script shared by
+        all templates, see `_make_script_loader`. This keeps the model small, which
+        Anki loads with the collection and syncs with AnkiWeb. app-anki is appended
+        after the script element, where Anki expects the note content to be. Anki
+        runs the script multiple times in the same JS environment, the loader is
+        injected the first time only.
 
         REFS:
         https://docs.ankiweb.net/templates/intro.html
@@ -60,29 +90,68 @@ class Models:
 {{#<FIELD_ID_CARD>}}
 
 <script id="rember-script-template">
-  var setup = async () => {
-    const injectScript = (src) => {
-      return new Promise((resolve, reject) => {
-        const script = document.createElement('script');
-        script.src = src;
-        script.async = true;
-        script.onload = resolve;
-        script.onerror = reject;
-        document.head.appendChild(script);
-      });
-    };
-    const injectCSS = (src) => {
-      return new Promise((resolve, reject) => {
-        const link = document.createElement('link');
-        link.rel = 'stylesheet';
-        link.type = 'text/css';
-        link.href = src;
-        link.onload = resolve;
-        link.onerror = reject;
-        document.head.appendChild(link);
-      });
+  (() => {
+    const args = {
+      fieldData: String.raw`{{<FIELD_DATA>}}`,
+      idCard: String.raw`{{<FIELD_ID_CARD>}}`,
+      side: '<SIDE>',
+      target: document.getElementById('rember-script-template').parentElement
     };
+    if (window.renderAppAnkiRember != undefined) {
+      window.renderAppAnkiRember(args);
+      return;
+    }
+    const script = document.createElement('script');
+    script.src = '<NAME_FILE_LOADER_APP_ANKI>';
+    script.onload = () => window.renderAppAnkiRember(args);
+    document.head.appendChild(script);
+  })();
+</script>
+
+{{/<FIELD_ID_CARD>}}
+"""
 
+        return (
+            template.replace("<FIELD_ID_CARD>", NAME_FIELD_ID_CARD(ix))
+            .replace("<NAME_FILE_LOADER_APP_ANKI>", NAME_FILE_LOADER_APP_ANKI)
+            .replace("<FIELD_DATA>", NAME_FIELD_DATA)
+            .replace("<SIDE>", side)
+        )
+
+    def _make_script_loader(self) -> str:
+        """
+        The script shared by the templates, copied in the media folder as
+        `NAME_FILE_LOADER_APP_ANKI`. It injects app-anki in the page and renders
+        the card for the arguments passed by the template, see `_make_template`.
+        """
+
+        script = """
+(() => {
+  if (window.renderAppAnkiRember != undefined) return;
+
+  const injectScript = (src) => {
+    return new Promise((resolve, reject) => {
+      const script = document.createElement('script');
+      script.src = src;
+      script.async = true;
+      script.onload = resolve;
+      script.onerror = reject;
+      document.head.appendChild(script);
+    });
+  };
+  const injectCSS = (src) => {
+    return new Promise((resolve, reject) => {
+      const link = document.createElement('link');
+      link.rel = 'stylesheet';
+      link.type = 'text/css';
+      link.href = src;
+      link.onload = resolve;
+      link.onerror = reject;
+      document.head.appendChild(link);
+    });
+  };
+
+  const setup = async () => {
     // Remove the Anki style tag, which interferes with app-anki.
     const styleAnki = document.querySelector('head > style');
     if (styleAnki != undefined) styleAnki.remove();
@@ -93,56 +162,41 @@ class Models:
 
     await injectScript('<NAME_FILE_SCRIPT_APP_ANKI>');
     await injectCSS('<NAME_FILE_CSS_APP_ANKI>');
-  }
-
-  var renderAppAnki = () => {
-    // Remove the pre tag wrapping the data field string.
-    const unwrapFieldData = (fieldData) => {
-      const matches = fieldData.match(/<pre>([\\S\\s]*?)<\\/pre>/);
-      if (matches == undefined || matches.length <= 1) {
-        throw new Error("Invalid field: <FIELD_DATA>");
-      }
-      return matches[1];
+  };
+
+  // Remove the pre tag wrapping the data field string.
+  const unwrapFieldData = (fieldData) => {
+    const matches = fieldData.match(/<pre>([\\S\\s]*?)<\\/pre>/);
+    if (matches == undefined || matches.length <= 1) {
+      throw new Error("Invalid field: <FIELD_DATA>");
     }
+    return matches[1];
+  };
 
-    const fieldData0 = String.raw`{{<FIELD_DATA>}}`;
-    const fieldData1 = unwrapFieldData(fieldData0);
-    const fieldData2 = JSON.parse(fieldData1);
+  // Set up app-anki once, even if several cards are rendered before it's ready
+  let promiseSetup = undefined;
 
-    const fieldIdCard = String.raw`{{<FIELD_ID_CARD>}}`;
+  window.renderAppAnkiRember = async ({ fieldData, idCard, side, target }) => {
+    if (promiseSetup == undefined) promiseSetup = setup();
+    await promiseSetup;
 
     // Name `AppAnki` comes from `vite.config.js` in `@rember/app-anki`
     new window.AppAnki({
-      // Append app-anki after this script element, where Anki expects the
-      // note content to be.
-      target: document.getElementById('rember-script-template').parentElement,
+      target,
       props: {
-        contentRemb: fieldData2,
-        idCard: fieldIdCard,
-        side: '<SIDE>'
+        contentRemb: JSON.parse(unwrapFieldData(fieldData)),
+        idCard,
+        side
       }
     });
-  }
-
-  // Anki runs this script multiple times in the same JS environment,
-  // make sure we call the 'setup' function once.
-  if (window.hasSetupAppAnki) {
-    renderAppAnki();
-  } else {
-    window.hasSetupAppAnki = true;
-    setup().then(renderAppAnki);
-  }
-</script>
-
-{{/<FIELD_ID_CARD>}}
+  };
+})();
 """
 
         return (
-            template.replace("<FIELD_ID_CARD>", NAME_FIELD_ID_CARD(ix))
-            .replace("<NAME_FILE_SCRIPT_APP_ANKI>", NAME_FILE_SCRIPT_APP_ANKI)
+            script.replace("<NAME_FILE_SCRIPT_APP_ANKI>", NAME_FILE_SCRIPT_APP_ANKI)
             .replace("<NAME_FILE_CSS_APP_ANKI>", NAME_FILE_CSS_APP_ANKI)
             .replace("<FIELD_DATA>", NAME_FIELD_DATA)
-            .replace("<SIDE>", side)
         )
 
     ##: create_model_rember
@@ -156,9 +210,10 @@ class Models:
         """
         models = self._col.models
 
-        # Skip if the model already exists
-        if models.by_name(NAME_MODEL_REMBER) is not None:
-            return
+        # Skip if the model, or a model created by a previous version, already exists
+        for name_model in [NAME_MODEL_REMBER, *NAMES_MODEL_REMBER_LEGACY]:
+            if models.by_name(name_model) is not None:
+                return
 
         ##: Create base model
 
@@ -185,15 +240,25 @@ class Models:
         field_media["size"] = 14
         models.add_field(notetype, field_media)
 
-        for ix in range(CNT_MAX_ANKI_CARDS):
+        ##: Add "Card" fields and templates
+
+        self._add_fields_id_card(notetype, range(CNT_TEMPLATES_INITIAL))
+
+        ##:
+
+        models.add(notetype)
+
+    def _add_fields_id_card(self, notetype: models.NotetypeDict, ixs: range) -> None:
+        """Add the "Card" fields with the given indices and their templates."""
+        models = self._col.models
+
+        for ix in ixs:
             field_id_card = models.new_field(NAME_FIELD_ID_CARD(ix))
             field_id_card["font"] = "Monospace"
             field_id_card["size"] = 14
             models.add_field(notetype, field_id_card)
 
-        ##: Add templates
-
-        for ix in range(CNT_MAX_ANKI_CARDS):
+        for ix in ixs:
             template_model_rember = models.new_template(NAME_TEMPLATE_MODEL_REMBER(ix))
             template_model_rember["qfmt"] = self._make_template("front", ix)
             template_model_rember["afmt"] = self._make_template("back", ix)
@@ -201,9 +266,34 @@ class Models:
             template_model_rember["bafmt"] = NAME_FIELD_NOTE
             models.add_template(notetype, template_model_rember)
 
-        ##:
+    ##: grow_model_rember
 
-        models.add(notetype)
+    def grow_model_rember(
+        self, notetype: models.NotetypeDict, cnt_fields_id_card: int
+    ) -> models.NotetypeDict:
+        """
+        Add "Card" fields and templates to the model up to `CNT_MAX_ANKI_CARDS`, if
+        it has fewer than `cnt_fields_id_card` of them. Return the updated model.
+
+        WARN: Adding fields and templates is a schema change, the next sync with
+        AnkiWeb is a full sync. Growing straight to `CNT_MAX_ANKI_CARDS` makes it
+        happen at most once per collection, see `CookieCollection` for the
+        notes a full download discards.
+        """
+        if cnt_fields_id_card > CNT_MAX_ANKI_CARDS:
+            raise RuntimeError(
+                f"Cannot grow the Rember model to {cnt_fields_id_card} cards (limit is {CNT_MAX_ANKI_CARDS})"
+            )
+        cnt_fields_id_card_prev = get_cnt_fields_id_card(notetype)
+        if cnt_fields_id_card <= cnt_fields_id_card_prev:
+            return notetype
+
+        self._add_fields_id_card(
+            notetype, range(cnt_fields_id_card_prev, CNT_MAX_ANKI_CARDS)
+        )
+        self._col.models.update_dict(notetype)
+
+        return self.get_model_rember()
 
     ##: create_media_app_anki
 
@@ -213,26 +303,64 @@ class Models:
         path_script_app_anki = os.path.join(path_app_anki, "app-anki.umd.cjs")
         path_css_app_anki = os.path.join(path_app_anki, "app-anki.css")
 
-        # Delete the files if they already exist, in order to update them
-        self._col.media.trash_files([NAME_FILE_SCRIPT_APP_ANKI, NAME_FILE_CSS_APP_ANKI])
-
         with open(path_script_app_anki, "rb") as file_script:
-            self._col.media.write_data(NAME_FILE_SCRIPT_APP_ANKI, file_script.read())
+            self._create_media(NAME_FILE_SCRIPT_APP_ANKI, file_script.read())
         with open(path_css_app_anki, "rb") as file_css:
-            self._col.media.write_data(NAME_FILE_CSS_APP_ANKI, file_css.read())
+            self._create_media(NAME_FILE_CSS_APP_ANKI, file_css.read())
+        self._create_media(
+            NAME_FILE_LOADER_APP_ANKI, self._make_script_loader().encode("utf-8")
+        )
+
+    def _create_media(self, name_file_media: str, data: bytes) -> None:
+        """
+        Write the data to the media folder, unless the media file already has the
+        same content. This runs every time the collection is loaded, skipping
+        unchanged files avoids rewriting them and queueing a media sync.
+        """
+        path_file_media = os.path.join(self._col.media.dir(), name_file_media)
+        if os.path.exists(path_file_media):
+            if os.path.getsize(path_file_media) == len(data):
+                with open(path_file_media, "rb") as file_media:
+                    checksum_media = hashlib.sha1(file_media.read()).digest()
+                if checksum_media == hashlib.sha1(data).digest():
+                    return
+            # Delete the file in order to update it, otherwise Anki would write
+            # the new content to a file with a different name
+            self._col.media.trash_files([name_file_media])
+
+        self._col.media.write_data(name_file_media, data)
 
     ##: get_model_rember
 
     def get_model_rember(self) -> models.NotetypeDict:
-        notetype = self._col.models.by_name(NAME_MODEL_REMBER)
-        if notetype is None:
-            raise RuntimeError("Rember model not found")
-        return notetype
+        """The model of the notes imported from Rember, a legacy model if it exists."""
+        global _id_model_rember_cached
+
+        # Anki caches the models by id, a lookup by name is a backend call
+        if _id_model_rember_cached is not None:
+            notetype = self._col.models.get(models.NotetypeId(_id_model_rember_cached))
+            if notetype is not None and notetype["name"] in [
+                *NAMES_MODEL_REMBER_LEGACY,
+                NAME_MODEL_REMBER,
+            ]:
+                return notetype
+
+        for name_model in [*NAMES_MODEL_REMBER_LEGACY, NAME_MODEL_REMBER]:
+            notetype = self._col.models.by_name(name_model)
+            if notetype is not None:
+                _id_model_rember_cached = notetype["id"]
+                return notetype
+        raise RuntimeError("Rember model not found")
 
 
 #: Utils
 
 
+def get_cnt_fields_id_card(notetype: models.NotetypeDict) -> int:
+    """Number of "Card" fields in the model, there is one template for each."""
+    return len(notetype["tmpls"])
+
+
 def wrap_field_data(field_data: str) -> str:
     """Util for wrapping the data field in a pre tag, to format the field correctly in the Anki editor."""
     return f"<pre>{field_data}</pre>"
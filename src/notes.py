@@ -1,15 +1,114 @@
 import json
-from typing import Optional
+from typing import Iterable, Optional
 
 from anki import cards, collection, notes
+from anki.models import NotetypeDict
+from anki.utils import ids2str, split_fields
 from aqt.main import AnkiQt
 
-from . import decks, models, logger
+from . import decks, models, logger, metrics, quarantine_rembs
 from .puller_client import Patch
 
+#: Constants
+
+PREFIX_KEY_REMB = "Remb/"
+
+# Number of guids looked up in a single query, staying well below SQLite's
+# limit on the number of query parameters, see `Notes._find_map_guid_note`.
+SIZE_MAX_PARAMS_QUERY = 500
+
+# Number of lookups by guid in a pull, each scanning the notes table, after
+# which the notes of the other models are loaded once instead, see
+# `Notes._find_map_guid_note`
+CNT_MAX_QUERIES_GUID = 4
+
+# Errors raised by a single invalid remb, which is quarantined instead of
+# failing the whole patch, see `Notes._quarantine_remb`
+ERRORS_REMB = (KeyError, TypeError, ValueError, RuntimeError)
+
+# Minimum number of rembs created in a batch to use the bulk import, if enabled
+# with the `import_bulk_rembs` option of the add-on config, see
+# `Notes._import_rembs_bulk`. Small deltas are faster to add one note at a time.
+SIZE_MIN_IMPORT_BULK = 200
+
 #:
 
 
+class RowNote:
+    """A row of the notes table, see `Notes._get_rows_note`."""
+
+    def __init__(self, id: int, guid: str, fields: list[str]):
+        self.id = id
+        self.guid = guid
+        self.fields = fields
+
+
+class MaterializerFields:
+    """
+    Build the fields of a note of the Rember model as a list, in the order of
+    the model. The ordinals of the fields are computed once from the model,
+    instead of looking up each field by name, e.g. with `note[name]`.
+    """
+
+    def __init__(self, notetype: NotetypeDict):
+        map_name_ord = {field["name"]: field["ord"] for field in notetype["flds"]}
+        self._cnt_fields = len(notetype["flds"])
+        self._ord_field_link = map_name_ord[models.NAME_FIELD_LINK]
+        self._ord_field_note = map_name_ord[models.NAME_FIELD_NOTE]
+        self._ord_field_data = map_name_ord[models.NAME_FIELD_DATA]
+        self._ord_field_media = map_name_ord[models.NAME_FIELD_MEDIA]
+        # The user might have reordered the fields of the model, the `i`-th
+        # "Card" field is not necessarily next to the previous one
+        self._ords_field_id_card = [
+            map_name_ord[models.NAME_FIELD_ID_CARD(ix_field)]
+            for ix_field in range(models.get_cnt_fields_id_card(notetype))
+        ]
+
+    @property
+    def ord_field_data(self) -> int:
+        return self._ord_field_data
+
+    def get_fields_id_card(self, fields: list[str]) -> list[str]:
+        """The "Card" fields of a note, the `i`-th is the id of the card rendered
+        by the `i`-th template, or empty."""
+        return [fields[ord_field] for ord_field in self._ords_field_id_card]
+
+    def make_fields(
+        self,
+        id_remb: str,
+        content_remb: dict,
+        map_id_card_ix_field: dict[str, int],
+        field_data: str,
+    ) -> list[str]:
+        # The "Card" fields not in the map are left empty
+        fields = [""] * self._cnt_fields
+
+        field_link = f"""<a href="https://rember.com/r/${id_remb}">Edit in Rember (Remb ${id_remb})</a>"""
+        fields[self._ord_field_link] = field_link
+
+        field_note = content_remb["note"]["text"]
+        if not isinstance(field_note, str):
+            raise ValueError(
+                f"Invalid remb content for remb {id_remb}: 'text' not found or not a string."
+            )
+        fields[self._ord_field_note] = field_note
+
+        fields[self._ord_field_data] = field_data
+
+        # Set the id_card in fields according to the map
+        for id_card, ix_field in map_id_card_ix_field.items():
+            if not 0 <= ix_field < len(self._ords_field_id_card):
+                raise RuntimeError(
+                    f"Invalid field index {ix_field} for card {id_card}, the Rember model has {len(self._ords_field_id_card)} card fields"
+                )
+            fields[self._ords_field_id_card[ix_field]] = id_card
+
+        field_media = ""  # Media are currently not supported in Rember
+        fields[self._ord_field_media] = field_media
+
+        return fields
+
+
 class Notes:
 
     def __init__(
@@ -19,18 +118,51 @@ class Notes:
         models: models.Models,
         decks: decks.Decks,
         logger: logger.Logger,
+        quarantine_rembs: quarantine_rembs.QuarantineRembs,
+        metrics: metrics.Metrics,
+        ids_remb_cleared: Optional[set[str]] = None,
     ):
         self._mw = mw
         self._col = col
+        self._models = models
         self._notetype = models.get_model_rember()
-        self._deck = decks.get_deck_rember()
+        self._materializer_fields = MaterializerFields(self._notetype)
+        self._id_deck = decks.get_id_deck_rember()
         self._logger = logger
+        self._metrics = metrics
+
+        config = (
+            mw.addonManager.getConfig(mw.addonManager.addonFromModule(__name__)) or {}
+        )
+        self._is_import_bulk = bool(config.get("import_bulk_rembs", False))
+
+        # State across the batches of a patch, see `process_patch`. The rembs
+        # cleared by a previous interrupted pull are passed in `ids_remb_cleared`.
+        self._cnt_ops = 0
+        self._ids_remb_cleared = set(ids_remb_cleared or ())
+        self._cnt_rembs_created = 0
+        self._cnt_rembs_updated = 0
+        self._cnt_rembs_unchanged = 0
+        self._cnt_rembs_deleted = 0
+
+        # guid -> (id_note, id_model), loaded on first use and kept up to date
+        # as notes are created and deleted, see `_find_map_guid_note`
+        self._map_guid_note: Optional[dict[str, tuple[int, int]]] = None
+        self._is_map_guid_note_complete = False
+        self._cnt_queries_guid = 0
+
+        self._quarantine_rembs = quarantine_rembs
+        self._ids_remb_quarantined = set(self._quarantine_rembs.get_all())
+        self._ids_remb_quarantined_now: set[str] = set()
 
     ##: process_patch
 
     def process_patch(self, patch: Patch) -> None:
-        rembs_to_create: list[dict] = []
-        rembs_to_update: list[dict] = []
+        """
+        Process a batch of operations of the patch. The patch can be split in
+        several batches, processed in order, call `complete_patch` after the last one.
+        """
+        rembs_to_put: dict[str, dict] = {}  # id_remb -> value
         ids_remb_to_delete: set[str] = set()
 
         for ix, op in enumerate(patch):
@@ -38,154 +170,414 @@ class Notes:
             # clear
 
             if op["op"] == "clear":
-                if ix != 0:
-                    raise RuntimeError(f"Unexpected 'clear' op in position {ix}")
+                if self._cnt_ops + ix != 0:
+                    raise RuntimeError(
+                        f"Unexpected 'clear' op in position {self._cnt_ops + ix}"
+                    )
                 # Find all notes using the Rember model and mark them for deletion.
                 # Later, if we encounter a "put" operation for any of these notes,
                 # we'll remove them from the deletion list since they should be kept.
-                ids_remb = self._find_ids_remb_by_id_model(self._notetype["id"])
-                ids_remb_to_delete.update(ids_remb)
+                # The deletion happens in `complete_patch`, since the "put" operations
+                # can be in later batches.
+                self._ids_remb_cleared.update(
+                    guid
+                    for guid, (_, id_model) in self._get_map_guid_note().items()
+                    if id_model == self._notetype["id"]
+                )
+                # The quarantined rembs are cleared too, otherwise a remb deleted
+                # on the server would be retried, see `retry_rembs_quarantined`.
+                # `complete_patch` removes them from the quarantine.
+                self._ids_remb_cleared.update(self._ids_remb_quarantined)
 
             # del
 
             if op["op"] == "del":
-                if not op["key"].startswith("Remb/"):
+                if not op["key"].startswith(PREFIX_KEY_REMB):
                     continue
                 id_remb = self._id_remb_from_key_remb(op["key"])
                 ids_remb_to_delete.add(id_remb)
+                rembs_to_put.pop(id_remb, None)
 
             # put
 
             if op["op"] == "put":
-                if not op["key"].startswith("Remb/"):
+                if not op["key"].startswith(PREFIX_KEY_REMB):
                     continue
                 id_remb = self._id_remb_from_key_remb(op["key"])
-                id_note = self._id_note_by_guid(id_remb)
-                value = op["value"]
-                if id_note is None:
-                    rembs_to_create.append(value)
-                else:
-                    # Skip if the note does not belong to the "Rember" model ()
-                    id_model = self._id_model_by_guid_note(id_remb)
-                    if id_model != self._notetype["id"]:
-                        self._logger.warn(
-                            f"Skipping note with guid {id_remb}. Note does not belong to Rember model",
-                            self._mw,
-                        )
-                        continue
-                    # Add `id_note` to the remb json data
-                    value["id_note"] = id_note
-                    rembs_to_update.append(value)
-
-        # Remove rembs that will be created/updated from the deletion set
-        ids_remb_to_delete -= {remb["id"] for remb in rembs_to_create + rembs_to_update}
-
-        self._create_rembs(rembs_to_create)
-        self._update_rembs(rembs_to_update)
-        self._delete_rembs(ids_remb_to_delete)
-
-    def _create_rembs(self, rembs: list[dict]) -> None:
-        _notes: list[collection.AddNoteRequest] = []
+                rembs_to_put[id_remb] = op["value"]
+                ids_remb_to_delete.discard(id_remb)
 
-        for remb in rembs:
-            id_remb = remb["id"]
+        self._cnt_ops += len(patch)
 
-            content_remb = remb["content"]
-            if not isinstance(content_remb, dict):
-                raise ValueError(
-                    f"Invalid remb content for remb {id_remb}: expected 'content' to be a dictionary, got {type(content_remb)}"
+        # Remove rembs that will be created/updated from the deletion sets
+        ids_remb_to_delete -= rembs_to_put.keys()
+        self._ids_remb_cleared -= rembs_to_put.keys() | ids_remb_to_delete
+
+        # Resolve all guids at once, instead of querying the notes table (which
+        # has no index on guid) once per remb
+        map_guid_note = self._find_map_guid_note(
+            rembs_to_put.keys() | ids_remb_to_delete
+        )
+
+        rembs_to_create: dict[str, dict] = {}  # id_remb -> value
+        rembs_to_update: dict[str, dict] = {}  # id_remb -> value
+        for id_remb, value in rembs_to_put.items():
+            if id_remb not in map_guid_note:
+                rembs_to_create[id_remb] = value
+                continue
+            id_note, id_model = map_guid_note[id_remb]
+            # Skip if the note does not belong to the "Rember" model ()
+            if id_model != self._notetype["id"]:
+                self._logger.warn(
+                    f"Skipping note with guid {id_remb}. Note does not belong to Rember model",
+                    self._mw,
                 )
+                continue
+            # Add `id_note` to the remb json data
+            value["id_note"] = id_note
+            rembs_to_update[id_remb] = value
+
+        with self._metrics.span("notes_create"):
+            self._create_rembs(rembs_to_create)
+        with self._metrics.span("notes_update"):
+            self._update_rembs(rembs_to_update)
+        with self._metrics.span("notes_delete"):
+            self._delete_rembs(ids_remb_to_delete, map_guid_note)
+
+    @property
+    def ids_remb_cleared(self) -> set[str]:
+        """Rembs cleared by the patch that will be deleted by `complete_patch`,
+        unless they are put back by a later batch."""
+        return self._ids_remb_cleared
+
+    ##: retry_rembs_quarantined
+
+    def retry_rembs_quarantined(self) -> None:
+        """
+        Put again the rembs quarantined by previous pulls, the error might have
+        been fixed by an add-on update. Rembs put or deleted by this pull are not
+        retried, since they already left the quarantine or were quarantined again
+        with their latest value. Call after the last batch, before `complete_patch`.
+        """
+        patch: Patch = [
+            {"op": "put", "key": f"{PREFIX_KEY_REMB}{id_remb}", "value": value["value"]}
+            for id_remb, value in self._quarantine_rembs.get_all().items()
+            if id_remb not in self._ids_remb_quarantined_now
+            and id_remb not in self._ids_remb_cleared
+        ]
+        if patch:
+            self._logger.info(f"Retrying {len(patch)} quarantined rembs", self._mw)
+            self.process_patch(patch)
+
+    ##: complete_patch
+
+    def complete_patch(self) -> None:
+        """Delete the rembs cleared by the patch and never put back, then log a summary."""
+        with self._metrics.span("notes_delete"):
+            map_guid_note = self._find_map_guid_note(self._ids_remb_cleared)
+            self._delete_rembs(self._ids_remb_cleared, map_guid_note)
+        self._ids_remb_cleared = set()
+
+        self._metrics.count("ops", self._cnt_ops)
+        self._metrics.count("rembs_created", self._cnt_rembs_created)
+        self._metrics.count("rembs_updated", self._cnt_rembs_updated)
+        self._metrics.count("rembs_unchanged", self._cnt_rembs_unchanged)
+        self._metrics.count("rembs_deleted", self._cnt_rembs_deleted)
+        self._metrics.count("rembs_quarantined", len(self._ids_remb_quarantined_now))
+
+        self._logger.info(
+            f"Rembs processed: {self._cnt_rembs_created} created, {self._cnt_rembs_updated} updated, {self._cnt_rembs_unchanged} unchanged, {self._cnt_rembs_deleted} deleted, {len(self._ids_remb_quarantined_now)} quarantined",
+            self._mw,
+        )
 
-            ids_card = self._ids_card_from_content_remb(content_remb)
+    def _create_rembs(self, rembs: dict[str, dict]) -> None:
+        """Create the notes of the rembs, `rembs` maps the id of each remb, taken
+        from the key of its operation, to its value."""
+        # id_remb -> (remb, content_remb, field_data, map_id_card_ix_field)
+        map_id_remb_prepared: dict[str, tuple[dict, dict, str, dict[str, int]]] = {}
+
+        for id_remb, remb in rembs.items():
+            try:
+                content_remb = remb["content"]
+                if not isinstance(content_remb, dict):
+                    raise ValueError(
+                        f"Invalid remb content for remb {id_remb}: expected 'content' to be a dictionary, got {type(content_remb)}"
+                    )
 
-            note = self._col.new_note(self._notetype)
-            # Anki overwrites note with the same guid. We use the Rember remb id as guid
-            # to identify Anki notes.
-            # REFS: https://github.com/kerrickstaley/genanki#note-guids
-            note.guid = id_remb
+                ids_card = self._ids_card_from_content_remb(content_remb)
+                map_id_card_ix_field = self._compute_map_id_card_ix_field([], ids_card)
+                field_data = self._compute_field_data(content_remb)
+            except ERRORS_REMB as e:
+                self._quarantine_remb(id_remb, remb, e)
+                continue
+            map_id_remb_prepared[id_remb] = (
+                remb,
+                content_remb,
+                field_data,
+                map_id_card_ix_field,
+            )
 
-            self._set_note_fields(note, id_remb, content_remb, ids_card)
+        # Grow the model before creating the notes, so that they get all the fields
+        self._grow_model_rember(
+            [prepared[3] for prepared in map_id_remb_prepared.values()]
+        )
+
+        if self._is_import_bulk and len(map_id_remb_prepared) >= SIZE_MIN_IMPORT_BULK:
+            # The rembs left out of the import are created one at a time below
+            map_id_remb_prepared = self._import_rembs_bulk(map_id_remb_prepared)
+
+        _notes: list[collection.AddNoteRequest] = []
+
+        for id_remb, (
+            remb,
+            content_remb,
+            field_data,
+            map_id_card_ix_field,
+        ) in map_id_remb_prepared.items():
+            try:
+                note = self._col.new_note(self._notetype)
+                # Anki overwrites note with the same guid. We use the Rember remb id as guid
+                # to identify Anki notes.
+                # REFS: https://github.com/kerrickstaley/genanki#note-guids
+                note.guid = id_remb
+
+                note.fields = self._materializer_fields.make_fields(
+                    id_remb, content_remb, map_id_card_ix_field, field_data
+                )
+            except ERRORS_REMB as e:
+                self._quarantine_remb(id_remb, remb, e)
+                continue
+            self._unquarantine_remb(id_remb)
 
             _notes.append(
-                collection.AddNoteRequest(note=note, deck_id=self._deck["id"])
+                collection.AddNoteRequest(note=note, deck_id=self._id_deck)
             )
 
         self._col.add_notes(_notes)
+        self._cnt_rembs_created += len(_notes)
 
-    def _update_rembs(self, rembs: list[dict]) -> None:
-        _notes: list[notes.Note] = []
+        map_guid_note = self._get_map_guid_note()
+        for request in _notes:
+            map_guid_note[request.note.guid] = (request.note.id, self._notetype["id"])
 
-        for remb in rembs:
-            id_remb = remb["id"]
+    def _import_rembs_bulk(
+        self,
+        map_id_remb_prepared: dict[str, tuple[dict, dict, str, dict[str, int]]],
+    ) -> dict[str, tuple[dict, dict, str, dict[str, int]]]:
+        """
+        Create the notes with Anki's import of foreign notes, the JSON format of
+        `anki.foreign_data`, which creates the notes and their cards in the
+        backend. Returns the prepared rembs that were not imported.
+        """
+        notes_foreign: list[dict] = []
+        for id_remb, (
+            remb,
+            content_remb,
+            field_data,
+            map_id_card_ix_field,
+        ) in map_id_remb_prepared.items():
+            try:
+                fields = self._materializer_fields.make_fields(
+                    id_remb, content_remb, map_id_card_ix_field, field_data
+                )
+            except ERRORS_REMB as e:
+                self._quarantine_remb(id_remb, remb, e)
+                continue
+            # `ForeignNote` in `anki.foreign_data` doesn't expose the guid, but the
+            # backend reads it, we use the Rember remb id as guid as in `_create_rembs`
+            notes_foreign.append(
+                {
+                    "guid": id_remb,
+                    "fields": fields,
+                    "tags": [],
+                    "notetype": self._notetype["id"],
+                    "deck": self._id_deck,
+                    "cards": [],
+                }
+            )
+        if not notes_foreign:
+            return {}
+
+        result_import = self._col.import_json_string(
+            json.dumps(
+                {
+                    "notes": notes_foreign,
+                    "notetypes": [],
+                    "default_deck": self._id_deck,
+                },
+                separators=(",", ":"),
+            )
+        )
+
+        # The import log reports the ids of the notes created, not their guids
+        ids_remb = [note_foreign["guid"] for note_foreign in notes_foreign]
+        ids_remb_imported = self._add_notes_to_map_guid_note(
+            [note_log.id.nid for note_log in result_import.log.new]
+        )
+
+        map_id_remb_prepared_left: dict[
+            str, tuple[dict, dict, str, dict[str, int]]
+        ] = {}
+        for id_remb in ids_remb:
+            if id_remb in ids_remb_imported:
+                self._unquarantine_remb(id_remb)
+                self._cnt_rembs_created += 1
+            else:
+                map_id_remb_prepared_left[id_remb] = map_id_remb_prepared[id_remb]
+        self._metrics.count("rembs_imported_bulk", len(ids_remb_imported))
+        if map_id_remb_prepared_left:
+            self._logger.warn(
+                f"Bulk import skipped {len(map_id_remb_prepared_left)} rembs, creating them one at a time",
+                self._mw,
+            )
+        return map_id_remb_prepared_left
+
+    def _update_rembs(self, rembs: dict[str, dict]) -> None:
+        """Update the notes of the rembs, see `_create_rembs`."""
+        # id_note -> ixs of the fields (and templates) assigned to a card
+        map_id_note_ixs_field: dict[int, set[int]] = {}
+
+        map_id_note_row = self._get_rows_note(
+            [remb["id_note"] for remb in rembs.values()]
+        )
+        ord_field_data = self._materializer_fields.ord_field_data
+
+        # id_remb -> (remb, row_note, content_remb, field_data, map_id_card_ix_field)
+        map_id_remb_prepared: dict[
+            str, tuple[dict, RowNote, dict, str, dict[str, int]]
+        ] = {}
+
+        for id_remb, remb in rembs.items():
             id_note = remb["id_note"]  # Set above in self.process_patch
             if id_note is None:
                 raise RuntimeError("Unreachable. 'id_note' not set.")
 
-            content_remb = remb["content"]
-            if not isinstance(content_remb, dict):
-                raise ValueError(
-                    f"Invalid remb content for remb {id_remb}: expected 'content' to be a dictionary, got {type(content_remb)}"
-                )
+            row_note = map_id_note_row[id_note]
+            if row_note.guid != id_remb:
+                raise RuntimeError("Unreachable. 'note.guid' does not match remb id.")
 
-            ids_card = self._ids_card_from_content_remb(content_remb)
+            try:
+                content_remb = remb["content"]
+                if not isinstance(content_remb, dict):
+                    raise ValueError(
+                        f"Invalid remb content for remb {id_remb}: expected 'content' to be a dictionary, got {type(content_remb)}"
+                    )
 
-            note = self._col.get_note(notes.NoteId(id_note))
-            if note.guid != id_remb:
-                raise RuntimeError("Unreachable. 'note.guid' does not match remb id.")
+                # The data field is the serialized remb content, skip the remb if it's
+                # unchanged. This avoids rewriting the note, which bumps its mtime and
+                # usn, re-runs card generation and uploads the note on the next sync.
+                field_data = self._compute_field_data(content_remb)
+                if row_note.fields[ord_field_data] == field_data:
+                    self._unquarantine_remb(id_remb)
+                    self._cnt_rembs_unchanged += 1
+                    continue
+
+                ids_card = self._ids_card_from_content_remb(content_remb)
+
+                map_id_card_ix_field = self._compute_map_id_card_ix_field(
+                    self._materializer_fields.get_fields_id_card(row_note.fields),
+                    ids_card,
+                )
+            except ERRORS_REMB as e:
+                self._quarantine_remb(id_remb, remb, e)
+                continue
+            map_id_remb_prepared[id_remb] = (
+                remb,
+                row_note,
+                content_remb,
+                field_data,
+                map_id_card_ix_field,
+            )
 
-            self._set_note_fields(note, id_remb, content_remb, ids_card)
+        # Grow the model before updating the notes, so that they get all the fields
+        self._grow_model_rember(
+            [prepared[4] for prepared in map_id_remb_prepared.values()]
+        )
+
+        _notes: list[notes.Note] = []
 
+        for id_remb, (
+            remb,
+            row_note,
+            content_remb,
+            field_data,
+            map_id_card_ix_field,
+        ) in map_id_remb_prepared.items():
+            try:
+                fields = self._materializer_fields.make_fields(
+                    id_remb, content_remb, map_id_card_ix_field, field_data
+                )
+            except ERRORS_REMB as e:
+                self._quarantine_remb(id_remb, remb, e)
+                continue
+            self._unquarantine_remb(id_remb)
+            map_id_note_ixs_field[row_note.id] = set(map_id_card_ix_field.values())
+
+            # Only the notes that changed are loaded, the unchanged ones are
+            # skipped above by reading the fields from the row
+            note = self._col.get_note(notes.NoteId(row_note.id))
+            note.fields = fields
             _notes.append(note)
 
-        self._col.update_notes(_notes, skip_undo_entry=True)
-        self._delete_empty_cards()
+        if _notes:
+            self._col.update_notes(_notes, skip_undo_entry=True)
+            with self._metrics.span("cards_empty_delete"):
+                self._delete_empty_cards(map_id_note_ixs_field)
+        self._cnt_rembs_updated += len(_notes)
 
-    def _delete_rembs(self, ids_remb: set[str]) -> None:
-        ids_note = [self._id_note_by_guid(id_remb) for id_remb in ids_remb]
+    def _delete_rembs(
+        self, ids_remb: set[str], map_guid_note: dict[str, tuple[int, int]]
+    ) -> None:
         ids_note = [
-            notes.NoteId(id_note) for id_note in ids_note if id_note is not None
+            notes.NoteId(map_guid_note[id_remb][0])
+            for id_remb in ids_remb
+            if id_remb in map_guid_note
         ]
         if ids_note:
             self._col.remove_notes(ids_note)
+        self._cnt_rembs_deleted += len(ids_note)
+
+        map_guid_note = self._get_map_guid_note()
+        for id_remb in ids_remb:
+            map_guid_note.pop(id_remb, None)
+
+        for id_remb in ids_remb:
+            self._unquarantine_remb(id_remb)
+
+    def _quarantine_remb(self, id_remb: str, remb: dict, error: Exception) -> None:
+        """Store the remb in the quarantine instead of failing the whole patch."""
+        value = {key: value for key, value in remb.items() if key != "id_note"}
+        message_error = f"{type(error).__name__}: {str(error)}"
+        self._quarantine_rembs.add(id_remb, value, message_error)
+        self._ids_remb_quarantined.add(id_remb)
+        self._ids_remb_quarantined_now.add(id_remb)
+        self._logger.warn(
+            f"Remb {id_remb} quarantined. {message_error}",
+            self._mw,
+        )
 
-    def _set_note_fields(
-        self, note: notes.Note, id_remb: str, content_remb: dict, ids_card: list[str]
-    ) -> None:
-        field_link = f"""<a href="https://rember.com/r/${id_remb}">Edit in Rember (Remb ${id_remb})</a>"""
-        note[models.NAME_FIELD_LINK] = field_link
-
-        field_note = content_remb["note"]["text"]
-        if not isinstance(field_note, str):
-            raise ValueError(
-                f"Invalid remb content for remb {id_remb}: 'text' not found or not a string."
-            )
-        note[models.NAME_FIELD_NOTE] = field_note
-
-        field_data = models.wrap_field_data(json.dumps(content_remb))
-        note[models.NAME_FIELD_DATA] = field_data
-
-        # Compute map id_card -> ix_field
-        map_id_card_ix_field = self._compute_map_id_card_ix_field(note, ids_card)
-        # Clear all fields first
-        for ix_field in range(models.CNT_MAX_ANKI_CARDS):
-            note[models.NAME_FIELD_ID_CARD(ix_field)] = ""
-        # Set the id_card in fields according to the map
-        for id_card, ix_field in map_id_card_ix_field.items():
-            note[models.NAME_FIELD_ID_CARD(ix_field)] = id_card
+    def _unquarantine_remb(self, id_remb: str) -> None:
+        if id_remb in self._ids_remb_quarantined:
+            self._quarantine_rembs.remove(id_remb)
+            self._ids_remb_quarantined.discard(id_remb)
+            self._ids_remb_quarantined_now.discard(id_remb)
 
-        field_media = ""  # Media are currently not supported in Rember
-        note[models.NAME_FIELD_MEDIA] = field_media
+    def _compute_field_data(self, content_remb: dict) -> str:
+        return models.wrap_field_data(json.dumps(content_remb))
 
     def _compute_map_id_card_ix_field(
-        self, note: notes.Note, ids_card: list[str]
+        self, fields_id_card: list[str], ids_card: list[str]
     ) -> dict[str, int]:
-        """See README.md section "Preserving the review history when a remb is edited"."""
+        """
+        See README.md section "Preserving the review history when a remb is edited".
+        `fields_id_card` are the current values of the "Card" fields of the note,
+        empty for a new note.
+        """
         # Read current state from existing fields
         map_id_card_ix_field_prev = {}  # id_card -> ix_field
         ixs_field_prev = set()
 
-        for ix_field in range(models.CNT_MAX_ANKI_CARDS):
-            id_card = note[models.NAME_FIELD_ID_CARD(ix_field)]
+        for ix_field, id_card in enumerate(fields_id_card):
             if id_card:  # field has a card
                 if id_card in map_id_card_ix_field_prev:
                     # Handle duplicate card IDs - keep the first occurrence
@@ -215,22 +607,115 @@ class Notes:
 
         return map_id_card_ix_field
 
-    def _delete_empty_cards(self) -> None:
-        """Remove empty Anki cards for the Rember notetype. See README.md for details."""
-        report_empty_cards = self._col.get_empty_cards()
-        ids_card_anki_to_delete = []
-        for note_with_empty_cards in report_empty_cards.notes:
-            note = self._col.get_note(notes.NoteId(note_with_empty_cards.note_id))
-            if note.mid == self._notetype["id"]:
-                ids_card_anki_to_delete.extend(
-                    [cards.CardId(id) for id in note_with_empty_cards.card_ids]
+    def _grow_model_rember(self, maps_id_card_ix_field: list[dict[str, int]]) -> None:
+        """Grow the model if the notes need more "Card" fields than it has, see
+        `Models.grow_model_rember`."""
+        cnt_fields_id_card = max(
+            (
+                max(map_id_card_ix_field.values()) + 1
+                for map_id_card_ix_field in maps_id_card_ix_field
+                if map_id_card_ix_field
+            ),
+            default=0,
+        )
+        cnt_fields_id_card_prev = models.get_cnt_fields_id_card(self._notetype)
+        if cnt_fields_id_card <= cnt_fields_id_card_prev:
+            return
+
+        self._notetype = self._models.grow_model_rember(
+            self._notetype, cnt_fields_id_card
+        )
+        self._materializer_fields = MaterializerFields(self._notetype)
+        self._logger.info(
+            f"Rember model grown from {cnt_fields_id_card_prev} to {models.get_cnt_fields_id_card(self._notetype)} card templates, the next sync is a full sync",
+            self._mw,
+        )
+
+    def _delete_empty_cards(self, map_id_note_ixs_field: dict[int, set[int]]) -> None:
+        """
+        Remove empty Anki cards of the updated Rember notes. See README.md for details.
+
+        The template named "Card #i" renders the `i`-th card field, so a card is
+        empty if the field index of its template is not one of the field indices
+        assigned to the note. We only look at the cards of the given notes, instead
+        of computing the empty cards report for the whole collection.
+        """
+        db = self._col.db
+        if db is None:
+            raise RuntimeError("Database connection is None")
+
+        if not map_id_note_ixs_field:
+            return
+
+        map_ord_ix_field = self._get_map_ord_ix_field()
+        if map_ord_ix_field is None:
+            ids_card_anki_to_delete = self._find_ids_card_empty(map_id_note_ixs_field)
+        else:
+            ids_card_anki_to_delete = [
+                cards.CardId(id_card)
+                for id_card, id_note, ord in db.all(
+                    f"""select id, nid, ord from cards where nid in {ids2str(map_id_note_ixs_field)}"""
                 )
-        self._col.remove_cards_and_orphaned_notes(ids_card_anki_to_delete)
+                if map_ord_ix_field[ord] not in map_id_note_ixs_field[id_note]
+            ]
+        if ids_card_anki_to_delete:
+            self._col.remove_cards_and_orphaned_notes(ids_card_anki_to_delete)
+            # Notes without card fields lost all their cards and were removed
+            ids_note_orphaned = {
+                id_note
+                for id_note, ixs_field in map_id_note_ixs_field.items()
+                if not ixs_field
+            }
+            if ids_note_orphaned:
+                map_guid_note = self._get_map_guid_note()
+                for guid in [
+                    guid
+                    for guid, (id_note, _) in map_guid_note.items()
+                    if id_note in ids_note_orphaned
+                ]:
+                    del map_guid_note[guid]
+        self._metrics.count("cards_empty_deleted", len(ids_card_anki_to_delete))
+
+    def _get_map_ord_ix_field(self) -> Optional[dict[int, int]]:
+        """
+        Map the `ord` of each template to the index of the card field it renders,
+        or None if a template was renamed. Users can reorder the templates in
+        Anki's "Card Types" dialog, so the `ord` of a template is not necessarily
+        the index of its card field.
+        """
+        map_name_ix_field = {
+            models.NAME_TEMPLATE_MODEL_REMBER(ix_field): ix_field
+            for ix_field in range(models.get_cnt_fields_id_card(self._notetype))
+        }
+        map_ord_ix_field: dict[int, int] = {}
+        for template in self._notetype["tmpls"]:
+            ix_field = map_name_ix_field.get(template["name"])
+            if ix_field is None:
+                return None
+            map_ord_ix_field[template["ord"]] = ix_field
+        return map_ord_ix_field
+
+    def _find_ids_card_empty(
+        self, map_id_note_ixs_field: dict[int, set[int]]
+    ) -> list[cards.CardId]:
+        """Empty cards of the given notes according to Anki, which renders their
+        templates, used when the templates can't be mapped to the card fields."""
+        self._logger.warn(
+            "The templates of the Rember model were renamed, checking empty cards with Anki",
+            self._mw,
+        )
+        report_empty_cards = self._col.get_empty_cards()
+        return [
+            cards.CardId(id_card)
+            for note_with_empty_cards in report_empty_cards.notes
+            if note_with_empty_cards.note_id in map_id_note_ixs_field
+            for id_card in note_with_empty_cards.card_ids
+        ]
 
     ##: Utils
 
     def _id_remb_from_key_remb(self, key: str) -> str:
-        return key[len("Remb/") :]
+        return key[len(PREFIX_KEY_REMB) :]
 
     def _ids_card_from_content_remb(self, content_remb: dict) -> list[str]:
         """
@@ -282,42 +767,112 @@ class Notes:
 
         return ids_card
 
-    def _id_note_by_guid(self, guid: str) -> Optional[int]:
+    def _get_map_guid_note(self) -> dict[str, tuple[int, int]]:
+        """
+        Map guid -> `(id_note, id_model)` of the pull. The notes of the Rember
+        model are loaded once with the index on mid, the other guids are added by
+        `_find_map_guid_note` when they are looked up.
+        """
+        if self._map_guid_note is None:
+            db = self._col.db
+            if db is None:
+                raise RuntimeError("Database connection is None")
+
+            self._map_guid_note = {
+                guid: (id_note, id_model)
+                for guid, id_note, id_model in db.all(
+                    """select guid, id, mid from notes where mid = ?""",
+                    self._notetype["id"],
+                )
+            }
+        return self._map_guid_note
+
+    def _find_map_guid_note(
+        self, guids: Iterable[str]
+    ) -> dict[str, tuple[int, int]]:
+        """
+        Resolve guids to `(id_note, id_model)`, including notes of other models,
+        so that the caller can check model ownership.
+
+        The notes table has no index on guid, so each lookup by guid scans the
+        table. The guids of the Rember notes are in the map of the pull, the
+        others are looked up with a query of up to `SIZE_MAX_PARAMS_QUERY` guids,
+        to find notes of other models with the same guid. If they don't fit in a
+        single query, e.g. during a large import, or after `CNT_MAX_QUERIES_GUID`
+        queries, the
+        notes of the other models are loaded once instead, so that the cost of
+        the lookups is linear in the size of the pull.
+        """
         db = self._col.db
         if db is None:
             raise RuntimeError("Database connection is None")
 
-        return db.scalar(
-            """select id from notes where guid = ?""",
-            guid,
-        )
+        guids = set(guids)
+        map_guid_note = self._get_map_guid_note()
+
+        guids_missing = [guid for guid in guids if guid not in map_guid_note]
+        if guids_missing and not self._is_map_guid_note_complete:
+            if (
+                len(guids_missing) > SIZE_MAX_PARAMS_QUERY
+                or self._cnt_queries_guid >= CNT_MAX_QUERIES_GUID
+            ):
+                rows = db.all(
+                    """select guid, id, mid from notes where mid != ?""",
+                    self._notetype["id"],
+                )
+                self._is_map_guid_note_complete = True
+            else:
+                rows = db.all(
+                    f"""select guid, id, mid from notes where guid in ({", ".join("?" * len(guids_missing))})""",
+                    *guids_missing,
+                )
+                self._cnt_queries_guid += 1
+            for guid, id_note, id_model in rows:
+                map_guid_note[guid] = (id_note, id_model)
+
+        return {guid: map_guid_note[guid] for guid in guids if guid in map_guid_note}
 
-    def _id_model_by_guid_note(self, guid: str) -> Optional[int]:
+    def _add_notes_to_map_guid_note(self, ids_note: list[int]) -> set[str]:
+        """Record the notes created by the pull in the map, returns their guids."""
         db = self._col.db
         if db is None:
             raise RuntimeError("Database connection is None")
 
-        return db.scalar(
-            """select mid from notes where guid = ?""",
-            guid,
-        )
+        map_guid_note = self._get_map_guid_note()
+        guids: set[str] = set()
+        for guid, id_note, id_model in db.all(
+            f"""select guid, id, mid from notes where id in {ids2str(ids_note)}"""
+        ):
+            map_guid_note[guid] = (id_note, id_model)
+            guids.add(guid)
+        return guids
 
-    def _find_ids_note_by_id_model(self, id_model: int) -> list[int]:
+    def _get_rows_note(self, ids_note: list[int]) -> dict[int, RowNote]:
+        """
+        Fetch the fields of the notes with a single query, instead of calling
+        `col.get_note` (one backend round-trip) for each note, most of which are
+        usually unchanged, see `_update_rembs`.
+        """
         db = self._col.db
         if db is None:
             raise RuntimeError("Database connection is None")
 
-        return db.list(
-            """select id from notes where mid = ?""",
-            id_model,
-        )
+        if not ids_note:
+            return {}
 
-    def _find_ids_remb_by_id_model(self, id_model: int) -> list[str]:
+        return {
+            id_note: RowNote(id=id_note, guid=guid, fields=split_fields(flds))
+            for id_note, guid, flds in db.all(
+                f"""select id, guid, flds from notes where id in {ids2str(ids_note)}"""
+            )
+        }
+
+    def _find_ids_note_by_id_model(self, id_model: int) -> list[int]:
         db = self._col.db
         if db is None:
             raise RuntimeError("Database connection is None")
 
         return db.list(
-            """select guid from notes where mid = ?""",
+            """select id from notes where mid = ?""",
             id_model,
         )
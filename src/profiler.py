@@ -0,0 +1,133 @@
+import contextlib
+import os
+import time
+from typing import TYPE_CHECKING, Iterator
+
+from aqt.main import AnkiQt
+
+from . import logger
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+#: Constants
+
+# Number of captures kept in `user_files/profiles`, the older ones are deleted
+COUNT_MAX_CAPTURES = 5
+# Number of lines in the top allocations summary
+COUNT_TOP_ALLOCATIONS = 30
+
+#:
+
+
+class Profiler:
+    """
+    Opt-in capture of a run with cProfile and tracemalloc, enabled with the
+    `profile_pull` option of the add-on config. A capture writes a `.pstats`
+    file, which can be opened with `pstats` or snakeviz, and a summary of the
+    top allocations to `user_files/profiles`. Runs faster than
+    `profile_pull_threshold_seconds` are not written.
+    """
+
+    def __init__(self, mw: AnkiQt, logger: logger.Logger):
+        self._mw = mw
+        self._logger = logger
+
+        path_addon = os.path.dirname(os.path.realpath(__file__))
+        self._path_profiles = os.path.join(path_addon, "user_files", "profiles")
+
+    def _get_config(self) -> dict:
+        config = self._mw.addonManager.getConfig(
+            self._mw.addonManager.addonFromModule(__name__)
+        )
+        return config or {}
+
+    @contextlib.contextmanager
+    def capture(self, name: str) -> Iterator[None]:
+        """Profile the block if enabled in the config, otherwise do nothing."""
+        config = self._get_config()
+        if not config.get("profile_pull", False):
+            yield
+            return
+
+        # Imported only when profiling is enabled
+        import cProfile
+        import tracemalloc
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler, e.g. a debugger, is active
+            self._logger.warn(f"Profiler not started: {e}", self._mw)
+            yield
+            return
+        is_tracing = tracemalloc.is_tracing()
+        if not is_tracing:
+            tracemalloc.start()
+
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - time_start
+            snapshot = tracemalloc.take_snapshot()
+            _, size_peak = tracemalloc.get_traced_memory()
+            if not is_tracing:
+                tracemalloc.stop()
+
+            threshold = config.get("profile_pull_threshold_seconds", 0)
+            if duration >= threshold:
+                try:
+                    self._write_capture(name, profile, snapshot, duration, size_peak)
+                except OSError as e:
+                    # Don't let the profiler fail the run, or hide its error
+                    self._logger.error(
+                        "Failed to write profiler capture", self._mw, exception=e
+                    )
+
+    def _write_capture(
+        self,
+        name: str,
+        profile: "cProfile.Profile",
+        snapshot: "tracemalloc.Snapshot",
+        duration: float,
+        size_peak: int,
+    ) -> None:
+        os.makedirs(self._path_profiles, exist_ok=True)
+        time_now = time.time()
+        timestamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(time_now))}-{int(time_now * 1000) % 1000:03d}"
+        prefix = os.path.join(self._path_profiles, f"{name}-{timestamp}")
+
+        profile.dump_stats(f"{prefix}.pstats")
+
+        lines = [
+            f"Duration: {duration:.3f}s",
+            f"Peak traced memory: {size_peak / 1024 / 1024:.1f} MiB",
+            f"Top {COUNT_TOP_ALLOCATIONS} allocations by line:",
+        ]
+        for stat in snapshot.statistics("lineno")[:COUNT_TOP_ALLOCATIONS]:
+            lines.append(str(stat))
+        with open(f"{prefix}-allocations.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+        self._logger.info(
+            f"Profiler capture written to {prefix}.pstats, duration {duration:.3f}s",
+            self._mw,
+        )
+        self._delete_old_captures(name)
+
+    def _delete_old_captures(self, name: str) -> None:
+        # The timestamp in the file names sorts captures from oldest to newest
+        names_pstats = sorted(
+            name_file
+            for name_file in os.listdir(self._path_profiles)
+            if name_file.startswith(f"{name}-") and name_file.endswith(".pstats")
+        )
+        for name_pstats in names_pstats[:-COUNT_MAX_CAPTURES]:
+            prefix = os.path.join(self._path_profiles, name_pstats[: -len(".pstats")])
+            for path in (f"{prefix}.pstats", f"{prefix}-allocations.txt"):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -1,4 +1,5 @@
-from typing import Union
+import json
+from typing import Optional, Union
 
 from aqt.errors import show_exception
 from aqt.main import AnkiQt
@@ -10,14 +11,27 @@ from . import (
     auth_tokens,
     decks,
     logger,
+    metrics,
     models,
     notes,
+    profiler,
     puller_client,
+    puller_cookie_collection,
     puller_cookie_replicache,
+    puller_metrics,
+    puller_rembs_cleared,
+    puller_router,
+    quarantine_rembs,
     user_files,
     users,
 )
 
+#: Constants
+
+# Number of operations processed at a time, the patch is decoded while it's
+# processed, so this bounds the memory used by a pull.
+SIZE_BATCH_PATCH = 1000
+
 #:
 
 
@@ -34,10 +48,16 @@ class Puller:
         self._mw = mw
         self._auth = auth
         self._user_files = user_files
+        self._logger = logger
         self._cookies_replicache = puller_cookie_replicache.CookieReplicache(
+            user_files=self._user_files,
+            callback_set=self._logger.set_cookie_replicache,
+        )
+        self._rembs_cleared = puller_rembs_cleared.RembsCleared(
             user_files=self._user_files
         )
-        self._logger = logger
+        self._metrics_pulls = puller_metrics.MetricsPulls(user_files=self._user_files)
+        self._profiler = profiler.Profiler(mw=self._mw, logger=self._logger)
 
     ##: pull
 
@@ -48,6 +68,34 @@ class Puller:
         puller_client.ErrorClientPuller,
         auth_client.ErrorClientAuth,
         auth_tokens.ErrorTokens,
+    ]:
+        _metrics = metrics.Metrics()
+        status = "Exception"
+        try:
+            with self._profiler.capture("pull"), _metrics.span("total"):
+                result_pull = self._pull_op_metered(_metrics)
+            status = result_pull._tag
+            return result_pull
+        finally:
+            self._record_metrics(_metrics, status)
+
+    def _record_metrics(self, _metrics: metrics.Metrics, status: str) -> None:
+        """Log the metrics of the pull as a JSON record and keep them in user files."""
+        record = {"status": status, **_metrics.to_record()}
+        self._logger.info(f"Pull metrics: {json.dumps(record)}", self._mw)
+        try:
+            self._metrics_pulls.add(record)
+        except Exception as e:
+            # Don't let the metrics fail the pull, or hide the error of a failed pull
+            self._logger.error("Failed to store pull metrics", self._mw, exception=e)
+
+    def _pull_op_metered(
+        self, _metrics: metrics.Metrics
+    ) -> Union[
+        puller_client.SuccessReplicachePullForAnki,
+        puller_client.ErrorClientPuller,
+        auth_client.ErrorClientAuth,
+        auth_tokens.ErrorTokens,
     ]:
         if self._auth.state._tag != "SignedIn":
             raise RuntimeError(f"Invalid auth state: {self._auth.state._tag}")
@@ -58,43 +106,160 @@ class Puller:
         self._logger.info("Pull started", self._mw)
 
         # Refresh the auth tokens
-        result_refresh = self._auth.refresh_tokens()
+        with _metrics.span("refresh_tokens"):
+            result_refresh = self._auth.refresh_tokens()
         if result_refresh._tag != "Success":
             return result_refresh
         if result_refresh.tokens is not None:
             tokens = result_refresh.tokens
+        result_decode_token_access = auth_tokens.decode_token_access(tokens.access)
+        if result_decode_token_access._tag != "Success":
+            return result_decode_token_access
+        id_user = result_decode_token_access.payload.id_user
 
         # Get the stored cookie or None if not found
         cookie_replicache = self._cookies_replicache.get()
 
-        # Pull
-        result_replicache_pull_for_anki = puller_client.replicache_pull_for_anki(
-            cookie_replicache=cookie_replicache, token_access=tokens.access
+        _users = users.Users(user_files=self._user_files)
+        _quarantine_rembs = quarantine_rembs.QuarantineRembs(
+            user_files=self._user_files
         )
-        if result_replicache_pull_for_anki._tag != "Success":
-            return result_replicache_pull_for_anki
+        ids_remb_cleared = self._rembs_cleared.get()
+        # Created on the first batch of operations, most pulls return an empty
+        # patch and don't need to touch the collection, see `_make_notes`
+        _notes: Optional[notes.Notes] = None
 
-        # Store the new cookie for future pulls if successful
-        self._cookies_replicache.set(result_replicache_pull_for_anki.cookie)
+        def process_patch_users(patch: puller_client.Patch) -> None:
+            with _metrics.span("users"):
+                _users.process_patch(patch)
 
-        # Process patch
-        patch = result_replicache_pull_for_anki.patch
-        _users = users.Users(user_files=self._user_files)
-        _models = models.Models(col=self._mw.col)
-        _decks = decks.Decks(col=self._mw.col)
-        _notes = notes.Notes(
+        def process_patch_notes(patch: puller_client.Patch) -> None:
+            nonlocal _notes
+            with _metrics.span("notes"):
+                if _notes is None:
+                    _notes = self._make_notes(
+                        _metrics, _quarantine_rembs, ids_remb_cleared
+                    )
+                _notes.process_patch(patch)
+
+        # Each processor receives only the operations of its keys, a batch without
+        # remb operations doesn't touch the collection
+        router_patch = puller_router.RouterPatch()
+        router_patch.register(users.PREFIX_KEY_USER, process_patch_users)
+        router_patch.register(notes.PREFIX_KEY_REMB, process_patch_notes)
+
+        # Pull one page at a time, the cookie is stored after each page so that
+        # an interrupted pull resumes from the last processed page
+        while True:
+            result_replicache_pull_for_anki = puller_client.replicache_pull_for_anki(
+                cookie_replicache=cookie_replicache,
+                token_access=tokens.access,
+                metrics=_metrics,
+            )
+            _metrics.count("pages")
+            if result_replicache_pull_for_anki._tag != "Success":
+                return result_replicache_pull_for_anki
+
+            # The user data in the page and the new cookie are saved together, only
+            # if the whole page is processed successfully. If processing fails, the
+            # cookie is not advanced and the next pull retries this page only.
+            # The changes to the collection are not part of the transaction and
+            # are not rolled back: the notes created, updated or deleted, including
+            # by a bulk import, and the growth of the model stay, and the retry
+            # applies the page on top of them. The quarantine and the cleared
+            # rembs are user files, they are rolled back with the cookie.
+            with self._user_files.transaction():
+                # Process patch
+                # Reading the patch includes receiving and decoding the response
+                for patch in puller_client.batch_patch(
+                    _metrics.iter_timed(
+                        "read_patch", result_replicache_pull_for_anki.patch
+                    ),
+                    SIZE_BATCH_PATCH,
+                ):
+                    _metrics.count("ops_received", len(patch))
+                    patch = puller_client.compact_patch(patch)
+                    _metrics.count("ops_compacted", len(patch))
+
+                    router_patch.route(patch)
+
+                # The response might list these members after the patch, so they
+                # are available only once the patch has been consumed
+                has_more = result_replicache_pull_for_anki.has_more
+                cookie_replicache_next = result_replicache_pull_for_anki.cookie
+                if not result_replicache_pull_for_anki.is_paginated:
+                    # The patch is still processed in batches, but an interrupted
+                    # pull restarts from the previous cookie
+                    self._logger.info(
+                        "Server doesn't paginate, the patch was pulled in a single page",
+                        self._mw,
+                    )
+
+                if not has_more:
+                    self._logger.info("Users patch processed successfully", self._mw)
+                    # Skip the notes if the pull is empty and nothing is left over
+                    # from previous pulls
+                    if (
+                        _notes is None
+                        and not ids_remb_cleared
+                        and _quarantine_rembs.count() == 0
+                    ):
+                        self._logger.info(
+                            "Notes patch empty, collection not modified", self._mw
+                        )
+                    else:
+                        with _metrics.span("notes"):
+                            if _notes is None:
+                                _notes = self._make_notes(
+                                    _metrics, _quarantine_rembs, ids_remb_cleared
+                                )
+                            _notes.retry_rembs_quarantined()
+                            _notes.complete_patch()
+                        self._logger.info(
+                            "Notes patch processed successfully", self._mw
+                        )
+
+                # Store the new cookie for future pulls
+                if _notes is not None:
+                    ids_remb_cleared = _notes.ids_remb_cleared
+                self._rembs_cleared.set(ids_remb_cleared)
+                self._cookies_replicache.set(cookie_replicache_next)
+
+            # Copy the cookie to the collection once the page is saved, see
+            # `CookieCollection`
+            puller_cookie_collection.CookieCollection(col=self._mw.col).set(
+                cookie_replicache_next, id_user
+            )
+
+            if not has_more:
+                return result_replicache_pull_for_anki
+
+            if cookie_replicache_next == cookie_replicache:
+                raise RuntimeError(
+                    f"Pull did not advance: more pages announced for cookie {cookie_replicache}"
+                )
+            cookie_replicache = cookie_replicache_next
+            self._logger.info("Pull page processed, pulling next page", self._mw)
+
+    def _make_notes(
+        self,
+        _metrics: metrics.Metrics,
+        _quarantine_rembs: quarantine_rembs.QuarantineRembs,
+        ids_remb_cleared: set[str],
+    ) -> notes.Notes:
+        if self._mw.col is None:
+            raise RuntimeError("Collection is None")
+
+        return notes.Notes(
             mw=self._mw,
             col=self._mw.col,
-            models=_models,
-            decks=_decks,
+            models=models.Models(col=self._mw.col),
+            decks=decks.Decks(col=self._mw.col),
             logger=self._logger,
+            quarantine_rembs=_quarantine_rembs,
+            metrics=_metrics,
+            ids_remb_cleared=ids_remb_cleared,
         )
-        _users.process_patch(patch)
-        self._logger.info("Users patch processed successfully", self._mw)
-        _notes.process_patch(patch)
-        self._logger.info("Notes patch processed successfully", self._mw)
-
-        return result_replicache_pull_for_anki
 
     def _pull_failure(
         self,
@@ -151,3 +316,36 @@ class Puller:
         ).with_progress(
             "Syncing Rember data..."
         ).run_in_background()
+
+    ##: restore_cookie_from_collection
+
+    def restore_cookie_from_collection(self) -> None:
+        """
+        Use the cookie stored in the collection if it differs from the one in the
+        user files, which happens when a sync replaced the collection, e.g. a full
+        sync that downloaded it from AnkiWeb, see `CookieCollection`. The rembs
+        cleared by an interrupted pull belong to the replaced collection, they
+        are reset.
+        """
+        if self._auth.state._tag != "SignedIn" or self._mw.col is None:
+            return
+        result_decode_token_access = auth_tokens.decode_token_access(
+            self._auth.state.tokens.access
+        )
+        if result_decode_token_access._tag != "Success":
+            return
+
+        cookie_replicache = puller_cookie_collection.CookieCollection(
+            col=self._mw.col
+        ).get(result_decode_token_access.payload.id_user)
+        cookie_replicache_prev = self._cookies_replicache.get()
+        if cookie_replicache is None or cookie_replicache == cookie_replicache_prev:
+            return
+
+        with self._user_files.transaction():
+            self._cookies_replicache.set(cookie_replicache)
+            self._rembs_cleared.reset()
+        self._logger.info(
+            f"Cookie replicache restored from the collection, from {cookie_replicache_prev} to {cookie_replicache}",
+            self._mw,
+        )
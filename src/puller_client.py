@@ -1,15 +1,49 @@
+import codecs
+import functools
+import json
 import os
-from typing import Literal, TypedDict, Union
-
-import requests
-
-from . import info
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Iterable,
+    Iterator,
+    Literal,
+    TypedDict,
+    Union,
+)
+
+from . import info, metrics, session_http
+
+# The HTTP libraries are imported on the first pull, instead of when Anki loads
+# the add-on, see `session_http.get_session` and `_get_accept_encoding`
+if TYPE_CHECKING:
+    import requests
 
 #: Shared
 
 URL_BASE = f"https://www.{info.SITE_REMBER}"
 ENDPOINT_REPLICACHE_PULL_FOR_ANKI = f"{URL_BASE}/api/v1/replicache-pull-for-anki"
 VERSION_SCHEMA_REPLICACHE = "8"
+# Maximum number of operations in the patch of a single response, the server
+# splits larger patches in pages, see `SuccessReplicachePullForAnki.has_more`.
+# Pagination depends on the server: a server that supports `sizePageMax` lists
+# `hasMore` in every response, a server that doesn't ignores it and returns the
+# whole patch, see `SuccessReplicachePullForAnki.is_paginated`.
+SIZE_PAGE_MAX = 10000
+SIZE_CHUNK_RESPONSE = 64 * 1024
+
+# Characters that can follow a complete number in a JSON document
+CHARS_END_NUMBER_JSON = " \t\n\r,]}"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_accept_encoding() -> str:
+    """Content encodings that urllib3 decodes in this environment, gzip and
+    deflate are always available, br and zstd if the brotli and zstandard
+    packages are installed."""
+    from urllib3.util import make_headers
+
+    return make_headers(accept_encoding=True)["accept-encoding"]
 
 
 class ErrorClientPuller:
@@ -36,39 +70,91 @@ class ClearOperation(TypedDict):
     op: Literal["clear"]
 
 
-Patch = list[Union[PutOperation, DelOperation, ClearOperation]]
+Operation = Union[PutOperation, DelOperation, ClearOperation]
+
+Patch = list[Operation]
 
 
 class SuccessReplicachePullForAnki:
-    def __init__(self, cookie: Union[int, None], patch: Patch):
+    """
+    The patch is an iterator that decodes operations from the response body while
+    it's consumed, see `_decode_response_replicache_pull_for_anki`. The response
+    might list the other members after the patch, therefore they are available
+    only once the patch has been consumed.
+    """
+
+    def __init__(self, members: dict[str, Any], patch: Iterator[Operation]):
         self._tag: Literal["Success"] = "Success"
-        self.cookie = cookie
-        self.patch = patch
+        self._members = members
+        self._is_patch_consumed = False
+        self.patch = self._iter_patch(patch)
+
+    def _iter_patch(self, patch: Iterator[Operation]) -> Iterator[Operation]:
+        yield from patch
+        self._is_patch_consumed = True
+
+    def _get_member(self, key: str, default: Any = None) -> Any:
+        if not self._is_patch_consumed:
+            raise RuntimeError("Response not decoded yet, consume the patch first")
+        return self._members.get(key, default)
+
+    @property
+    def cookie(self) -> Union[int, None]:
+        return self._get_member("cookie")
+
+    @property
+    def is_paginated(self) -> bool:
+        """True if the server paginates the patch according to `sizePageMax`,
+        otherwise the response contains the whole patch."""
+        return self._get_member("hasMore") is not None
+
+    @property
+    def has_more(self) -> bool:
+        """True if the server has more operations for the next page, which starts
+        from `cookie`. False if the server doesn't paginate, see `is_paginated`."""
+        return self._get_member("hasMore", False)
 
 
 ResultReplicachePullForAnki = Union[SuccessReplicachePullForAnki, ErrorClientPuller]
 
 
 def replicache_pull_for_anki(
-    cookie_replicache: Union[int, None], token_access: str
+    cookie_replicache: Union[int, None],
+    token_access: str,
+    metrics: metrics.Metrics,
 ) -> ResultReplicachePullForAnki:
     payload = {
         "version": "1",
         "versionAddonRemberAnkiSync": info.VERSION_REMBER_ANKI_SYNC,
         "versionSchema": VERSION_SCHEMA_REPLICACHE,
         "cookie": cookie_replicache,
+        "sizePageMax": SIZE_PAGE_MAX,
+    }
+    headers = {
+        "authorization": f"Bearer {token_access}",
+        # The patch repeats the content of each remb, it compresses well. Servers
+        # that don't compress reply with plain JSON, either way requests decodes
+        # the response before `_iter_content_response` receives it.
+        "accept-encoding": _get_accept_encoding(),
     }
-    headers = {"authorization": f"Bearer {token_access}"}
 
-    response = requests.post(
-        ENDPOINT_REPLICACHE_PULL_FOR_ANKI, json=payload, headers=headers
-    )
+    # Stream the response, the patch is decoded while it's processed
+    with metrics.span("http"):
+        response = session_http.get_session().post(
+            ENDPOINT_REPLICACHE_PULL_FOR_ANKI,
+            json=payload,
+            headers=headers,
+            stream=True,
+            timeout=session_http.TIMEOUT,
+        )
 
     if response.ok:
         try:
-            data = response.json()
-            return _decode_response_replicache_pull_for_anki(data)
+            return _decode_response_replicache_pull_for_anki(
+                _iter_content_response(response, metrics)
+            )
         except Exception as e:
+            response.close()
             return ErrorClientPuller(message=f"Invalid response: {str(e)}")
     else:
         # Intercept `Replicache/ErrorVersionNotSupported`
@@ -85,59 +171,253 @@ def replicache_pull_for_anki(
         )
 
 
-def _decode_patch(data: list) -> Patch:
-    result: Patch = []
-
-    for operation in data:
-        if not isinstance(operation, dict):
-            raise ValueError("Each operation must be a dictionary")
-
-        op = operation.get("op")
-        if not isinstance(op, str):
-            raise ValueError("Operation must have a string 'op' field")
+def batch_patch(patch: Iterable[Operation], size_batch: int) -> Iterator[Patch]:
+    """Group the operations of a patch in lists of at most `size_batch` operations."""
+    batch: Patch = []
+    for operation in patch:
+        batch.append(operation)
+        if len(batch) >= size_batch:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def compact_patch(patch: Patch) -> Patch:
+    """
+    Reduce a batch of operations to the last operation for each key, since an
+    operation on a key overrides the previous ones. A leading `clear` is kept,
+    and the `del` operations after it are dropped, since the `clear` already
+    deletes their keys. A batch with a `clear` in another position is returned
+    as is, the processors reject it.
+    """
+    operation_clear = None
+    map_key_operation: dict[str, Operation] = {}
+    for ix, operation in enumerate(patch):
+        if operation["op"] == "clear":
+            if ix != 0:
+                return patch
+            operation_clear = operation
+            continue
+        map_key_operation[operation["key"]] = operation
+
+    patch_compacted: Patch = [] if operation_clear is None else [operation_clear]
+    for operation in map_key_operation.values():
+        if operation_clear is not None and operation["op"] == "del":
+            continue
+        patch_compacted.append(operation)
+    return patch_compacted
+
+
+def _iter_content_response(
+    response: "requests.Response", metrics: metrics.Metrics
+) -> Iterator[bytes]:
+    try:
+        for chunk in response.iter_content(chunk_size=SIZE_CHUNK_RESPONSE):
+            # Decoded size, requests decompresses gzip and deflate responses
+            metrics.count("bytes_response", len(chunk))
+            yield chunk
+    finally:
+        # Size on the wire, smaller than the decoded size if compressed
+        metrics.count("bytes_response_wire", response.raw.tell())
+        response.close()
+
+
+def _decode_operation(operation: Any) -> Operation:
+    if not isinstance(operation, dict):
+        raise ValueError("Each operation must be a dictionary")
+
+    op = operation.get("op")
+    if not isinstance(op, str):
+        raise ValueError("Operation must have a string 'op' field")
+
+    if op == "put":
+        if "key" not in operation or "value" not in operation:
+            raise ValueError("Put operation must have 'key' and 'value' fields")
+        if not isinstance(operation["key"], str):
+            raise ValueError("Put operation key must be a string")
+        if not isinstance(operation["value"], dict):
+            raise ValueError("Put operation value must be a dictionary")
+        return {"op": "put", "key": operation["key"], "value": operation["value"]}
+
+    elif op == "del":
+        if "key" not in operation:
+            raise ValueError("Del operation must have a 'key' field")
+        if not isinstance(operation["key"], str):
+            raise ValueError("Del operation key must be a string")
+        return {"op": "del", "key": operation["key"]}
+
+    elif op == "clear":
+        return {"op": "clear"}
 
-        if op == "put":
-            if "key" not in operation or "value" not in operation:
-                raise ValueError("Put operation must have 'key' and 'value' fields")
-            if not isinstance(operation["key"], str):
-                raise ValueError("Put operation key must be a string")
-            if not isinstance(operation["value"], dict):
-                raise ValueError("Put operation value must be a dictionary")
-            result.append(
-                {"op": "put", "key": operation["key"], "value": operation["value"]}
-            )
-
-        elif op == "del":
-            if "key" not in operation:
-                raise ValueError("Del operation must have a 'key' field")
-            if not isinstance(operation["key"], str):
-                raise ValueError("Del operation key must be a string")
-            result.append({"op": "del", "key": operation["key"]})
+    else:
+        raise ValueError(f"Invalid operation type: {op}")
 
-        elif op == "clear":
-            result.append({"op": "clear"})
 
-        else:
-            raise ValueError(f"Invalid operation type: {op}")
+def _decode_member_response(members: dict[str, Any], key: str, value: Any) -> None:
+    if key == "cookie":
+        if value is not None and not isinstance(value, int):
+            raise ValueError("Cookie must be an integer or None")
+        members["cookie"] = value
 
-    return result
+    if key == "hasMore":
+        if not isinstance(value, bool):
+            raise ValueError("hasMore must be a boolean")
+        members["hasMore"] = value
 
 
 def _decode_response_replicache_pull_for_anki(
-    data: dict,
+    chunks: Iterator[bytes],
 ) -> SuccessReplicachePullForAnki:
-    if "cookie" not in data:
-        raise ValueError("Response must contain 'cookie' field")
-
-    if "patch" not in data:
+    """
+    Decode the response incrementally. The members listed before the patch are
+    decoded eagerly, the operations in the patch and the members listed after it
+    are decoded while the patch is consumed, so that we never hold the whole
+    response in memory.
+    """
+    reader = _ReaderJson(chunks)
+    members: dict[str, Any] = {}
+
+    keys = reader.iter_keys_object()
+    is_patch_found = False
+    for key in keys:
+        if key == "patch":
+            is_patch_found = True
+            break
+        _decode_member_response(members, key, reader.read_value())
+
+    if not is_patch_found:
         raise ValueError("Response must contain 'patch' field")
 
-    cookie = data["cookie"]
-    if cookie is not None and not isinstance(cookie, int):
-        raise ValueError("Cookie must be an integer or None")
-
-    if not isinstance(data["patch"], list):
-        raise ValueError("Patch must be a list")
-    patch = _decode_patch(data["patch"])
+    def iter_patch() -> Iterator[Operation]:
+        try:
+            ix = 0
+            for _ in reader.iter_items_array():
+                operation = _decode_operation(reader.read_value())
+                if operation["op"] == "clear" and ix != 0:
+                    raise ValueError(f"Unexpected 'clear' op in position {ix}")
+                yield operation
+                ix += 1
+
+            # Resume decoding the members after the patch
+            for key in keys:
+                _decode_member_response(members, key, reader.read_value())
+            reader.expect_end()
+
+            if "cookie" not in members:
+                raise ValueError("Response must contain 'cookie' field")
+        except ValueError as e:
+            raise ValueError(f"Invalid response: {str(e)}") from e
+
+    return SuccessReplicachePullForAnki(members=members, patch=iter_patch())
+
+
+class _ReaderJson:
+    """
+    Minimal incremental reader for a JSON document, it reads values from an
+    iterator of bytes chunks and only buffers the value being decoded. The
+    containers we want to stream are traversed with `iter_keys_object` and
+    `iter_items_array`, everything else is decoded with `read_value`.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._decoder_utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder_json = json.JSONDecoder()
+        self._buffer = ""
+        self._ix = 0
+        self._is_exhausted = False
+
+    def _read_chunk(self) -> bool:
+        """Append the next chunk to the buffer, return False at the end of the document."""
+        if self._is_exhausted:
+            return False
+
+        # Drop the part of the buffer that has already been decoded
+        self._buffer = self._buffer[self._ix :]
+        self._ix = 0
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._buffer += self._decoder_utf8.decode(b"", final=True)
+            self._is_exhausted = True
+            return False
+
+        self._buffer += self._decoder_utf8.decode(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character, or "" at the end of the document."""
+        while True:
+            while self._ix < len(self._buffer) and self._buffer[self._ix] in " \t\n\r":
+                self._ix += 1
+            if self._ix < len(self._buffer):
+                return self._buffer[self._ix]
+            if not self._read_chunk():
+                return ""
+
+    def _expect(self, char: str) -> None:
+        char_next = self._peek()
+        if char_next != char:
+            raise ValueError(f"Expected '{char}', got '{char_next}'")
+        self._ix += 1
+
+    def read_value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, ix_end = self._decoder_json.raw_decode(self._buffer, self._ix)
+                # A number at the end of the buffer might continue in the next
+                # chunk, e.g. "-1." is decoded as -1, accept it only if it's
+                # followed by a delimiter
+                if self._is_exhausted or (
+                    ix_end < len(self._buffer)
+                    and (
+                        not isinstance(value, (int, float))
+                        or isinstance(value, bool)
+                        or self._buffer[ix_end] in CHARS_END_NUMBER_JSON
+                    )
+                ):
+                    self._ix = ix_end
+                    return value
+            except json.JSONDecodeError:
+                if self._is_exhausted:
+                    raise
+            self._read_chunk()
+
+    def iter_keys_object(self) -> Iterator[str]:
+        """
+        Iterate the keys of the next object, the caller must consume the value of
+        each key with `read_value` before requesting the next one.
+        """
+        self._expect("{")
+        is_first = True
+        while self._peek() != "}":
+            if not is_first:
+                self._expect(",")
+            is_first = False
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError("Object keys must be strings")
+            self._expect(":")
+            yield key
+        self._expect("}")
+
+    def iter_items_array(self) -> Iterator[None]:
+        """
+        Iterate the items of the next array, the caller must consume each item
+        with `read_value` before requesting the next one.
+        """
+        self._expect("[")
+        is_first = True
+        while self._peek() != "]":
+            if not is_first:
+                self._expect(",")
+            is_first = False
+            yield
+        self._expect("]")
+
+    def expect_end(self) -> None:
+        if self._peek() != "":
+            raise ValueError("Unexpected data after the response")
 
-    return SuccessReplicachePullForAnki(cookie=cookie, patch=patch)
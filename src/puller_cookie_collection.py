@@ -0,0 +1,47 @@
+from typing import Union
+
+from anki import collection
+
+#: Constants
+
+# Key in the collection config, named like the keys of the auth tokens in the
+# user profile, see `auth_tokens.set_tokens`
+KEY_CONFIG_COOKIE_REPLICACHE = "thirdPartyRemberCookieReplicache"
+
+#:
+
+
+class CookieCollection:
+    """
+    Copy of the cookie in the collection config, next to the notes pulled up to
+    it. `CookieReplicache` is stored in the user files, which AnkiWeb doesn't
+    sync: if a full sync downloads the collection from AnkiWeb, e.g. after the
+    Rember model grew, the notes pulled since the last upload are discarded
+    while the cookie in the user files has already moved past them. The copy in
+    the config is replaced together with the notes, see
+    `Puller.restore_cookie_from_collection`. The cookie is stored with the id of
+    the user, so that the cookie of an account is never used for another one.
+    """
+
+    def __init__(self, col: collection.Collection):
+        self._col = col
+
+    def get(self, id_user: str) -> Union[int, None]:
+        """The cookie stored for the user, None if not stored or stored for another user."""
+        value = self._col.get_config(KEY_CONFIG_COOKIE_REPLICACHE, None)
+        if not isinstance(value, dict) or value.get("id_user") != id_user:
+            return None
+        cookie_replicache = value.get("cookie_replicache")
+        if cookie_replicache is not None and not isinstance(cookie_replicache, int):
+            raise ValueError("cookie_replicache must be an integer or None")
+        return cookie_replicache
+
+    def set(self, cookie_replicache: Union[int, None], id_user: str) -> None:
+        # Setting the same cookie doesn't modify the collection
+        value = {"cookie_replicache": cookie_replicache, "id_user": id_user}
+        if self._col.get_config(KEY_CONFIG_COOKIE_REPLICACHE, None) == value:
+            return
+        self._col.set_config(KEY_CONFIG_COOKIE_REPLICACHE, value)
+
+    def reset(self) -> None:
+        self._col.remove_config(KEY_CONFIG_COOKIE_REPLICACHE)
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Callable, Optional, Union
 
 from . import user_files
 
@@ -7,8 +7,13 @@ from . import user_files
 
 class CookieReplicache:
 
-    def __init__(self, user_files: user_files.UserFiles):
+    def __init__(
+        self,
+        user_files: user_files.UserFiles,
+        callback_set: Optional[Callable[[Union[int, None]], None]] = None,
+    ):
         self._user_files = user_files
+        self._callback_set = callback_set
 
     def get(self) -> Union[int, None]:
         value = self._user_files.get("cookie_replicache")
@@ -17,7 +22,15 @@ class CookieReplicache:
         return value
 
     def set(self, cookie_replicache: Union[int, None]) -> None:
+        # Inside a `UserFiles.transaction` the cookie is saved together with the
+        # other writes, otherwise it's saved right away. Setting the same cookie
+        # doesn't write the file.
         self._user_files.set("cookie_replicache", cookie_replicache)
+        # Report the cookie only once it's saved, a discarded transaction
+        # leaves the stored cookie unchanged
+        if self._callback_set is not None:
+            callback_set = self._callback_set
+            self._user_files.call_after_commit(lambda: callback_set(cookie_replicache))
 
     def reset(self) -> None:
         self.set(None)
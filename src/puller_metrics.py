@@ -0,0 +1,27 @@
+from typing import Any
+
+from . import user_files
+
+#: Constants
+
+# Number of pulls whose metrics are kept, the older ones are dropped
+COUNT_MAX_METRICS_PULLS = 20
+
+#:
+
+
+class MetricsPulls:
+    """Metrics records of the last pulls, oldest first, see `metrics.Metrics`."""
+
+    def __init__(self, user_files: user_files.UserFiles):
+        self._user_files = user_files
+
+    def get(self) -> list[dict[str, Any]]:
+        value = self._user_files.get("metrics_pulls", [])
+        if not isinstance(value, list):
+            raise ValueError("metrics_pulls must be a list")
+        return value
+
+    def add(self, record: dict[str, Any]) -> None:
+        records = self.get() + [record]
+        self._user_files.set("metrics_pulls", records[-COUNT_MAX_METRICS_PULLS:])
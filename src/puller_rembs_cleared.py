@@ -0,0 +1,29 @@
+from . import user_files
+
+#:
+
+
+class RembsCleared:
+    """
+    Rembs marked for deletion by a 'clear' op and not yet put back by the pages
+    of the pull processed so far, see `Notes.complete_patch`. They are stored
+    together with the cookie, so that an interrupted pull resumes from the last
+    processed page without losing track of them.
+    """
+
+    def __init__(self, user_files: user_files.UserFiles):
+        self._user_files = user_files
+
+    def get(self) -> set[str]:
+        value = self._user_files.get("ids_remb_cleared")
+        if value is None:
+            return set()
+        if not isinstance(value, list):
+            raise ValueError("ids_remb_cleared must be a list or None")
+        return set(value)
+
+    def set(self, ids_remb_cleared: set[str]) -> None:
+        self._user_files.set("ids_remb_cleared", sorted(ids_remb_cleared))
+
+    def reset(self) -> None:
+        self.set(set())
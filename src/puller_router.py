@@ -0,0 +1,56 @@
+from typing import Callable
+
+from .puller_client import Patch
+
+#:
+
+HandlerPatch = Callable[[Patch], None]
+
+
+class RouterPatch:
+    """
+    Dispatch the operations of a batch to the handlers registered for their key
+    prefix, e.g. "Remb/", partitioning the batch in a single pass. Each handler
+    receives only the operations of its prefix, preceded by the `clear`
+    operation if the batch starts with one. Handlers without operations are not
+    called, operations without a registered prefix are dropped.
+
+    Handlers run in registration order on the calling thread: the user data is
+    staged in the `UserFiles` transaction of the pull thread, and the collection
+    must not be modified from several threads.
+    """
+
+    def __init__(self):
+        self._map_prefix_handler: dict[str, HandlerPatch] = {}
+
+    def register(self, prefix: str, handler: HandlerPatch) -> None:
+        # The prefix of a key is looked up up to the first "/", so that routing
+        # an operation doesn't depend on the number of handlers
+        if not prefix.endswith("/") or "/" in prefix[:-1]:
+            raise ValueError(f"Invalid prefix {prefix}, expected e.g. 'Remb/'")
+        if prefix in self._map_prefix_handler:
+            raise ValueError(f"Handler already registered for prefix {prefix}")
+        self._map_prefix_handler[prefix] = handler
+
+    def partition(self, patch: Patch) -> dict[str, Patch]:
+        map_prefix_patch: dict[str, Patch] = {
+            prefix: [] for prefix in self._map_prefix_handler
+        }
+        for ix, op in enumerate(patch):
+            if op["op"] == "clear":
+                if ix != 0:
+                    raise RuntimeError(f"Unexpected 'clear' op in position {ix}")
+                for patch_prefix in map_prefix_patch.values():
+                    patch_prefix.append(op)
+                continue
+
+            key = op["key"]
+            patch_prefix = map_prefix_patch.get(key[: key.find("/") + 1])
+            if patch_prefix is not None:
+                patch_prefix.append(op)
+        return map_prefix_patch
+
+    def route(self, patch: Patch) -> None:
+        for prefix, patch_prefix in self.partition(patch).items():
+            if patch_prefix:
+                self._map_prefix_handler[prefix](patch_prefix)
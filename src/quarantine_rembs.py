@@ -0,0 +1,44 @@
+from typing import Any
+
+from . import user_files
+
+#: Constants
+
+PREFIX_KEY_QUARANTINE_REMB = "QuarantineRemb/"
+
+#:
+
+
+class QuarantineRembs:
+    """
+    Rembs that could not be imported, for instance because they contain a crop
+    type that this version of the add-on does not support. They are stored with
+    the error, so that the rest of the patch can be imported, and they are
+    retried on later pulls, see `Notes.retry_rembs_quarantined`.
+    """
+
+    def __init__(self, user_files: user_files.UserFiles):
+        self._user_files = user_files
+
+    def get_all(self) -> dict[str, dict[str, Any]]:
+        """Return id_remb -> {"value": remb, "error": message}."""
+        return {
+            key[len(PREFIX_KEY_QUARANTINE_REMB) :]: value
+            for key, value in self._user_files.get_prefix(
+                PREFIX_KEY_QUARANTINE_REMB
+            ).items()
+        }
+
+    def count(self) -> int:
+        return len(self.get_all())
+
+    def add(self, id_remb: str, value: dict, error: str) -> None:
+        self._user_files.set(
+            f"{PREFIX_KEY_QUARANTINE_REMB}{id_remb}", {"value": value, "error": error}
+        )
+
+    def remove(self, id_remb: str) -> None:
+        self._user_files.delete(f"{PREFIX_KEY_QUARANTINE_REMB}{id_remb}")
+
+    def reset(self) -> None:
+        self._user_files.delete_prefix(PREFIX_KEY_QUARANTINE_REMB)
@@ -0,0 +1,47 @@
+# A single keep-alive HTTP session shared by the Rember API clients, so that
+# requests made back to back (eg. refreshing the tokens and then pulling) reuse
+# the same TCP connection and TLS session.
+
+import threading
+from typing import TYPE_CHECKING, Optional
+
+# Imported on the first request, instead of when Anki loads the add-on
+if TYPE_CHECKING:
+    import requests
+
+#: Constants
+
+# Seconds to wait for the connection to be established and between bytes
+# received from the server, passed as `timeout` to every request.
+TIMEOUT_CONNECT = 10
+TIMEOUT_READ = 60
+TIMEOUT = (TIMEOUT_CONNECT, TIMEOUT_READ)
+
+#:
+
+_session: Optional["requests.Session"] = None
+_lock = threading.Lock()
+
+#: get_session
+
+
+def get_session() -> "requests.Session":
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+        return _session
+
+
+#: close_session
+
+
+def close_session() -> None:
+    """Close the pooled connections, the next request opens a new session."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
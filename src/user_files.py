@@ -1,74 +1,351 @@
+import bisect
+import contextlib
 import json
 import os
+import sqlite3
 import threading
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+#: Constants
+
+# Marks a key deleted in a transaction, see `UserFiles.transaction`
+_DELETED = object()
+
+# Above this number of added or deleted keys in a save, the sorted keys are
+# rebuilt instead of updated key by key
+SIZE_MAX_UPDATE_KEYS_SORTED = 64
+
+#: Storage
+
+
+class StorageJson:
+    """
+    Stores all the data in a single JSON file. Each save rewrites the whole file,
+    to a temporary file that atomically replaces the previous one, so that an
+    interrupted write never leaves a truncated file behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Any]:
+        """Load data from the JSON file if it exists."""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, IOError, OSError):
+                return {}
+        else:
+            return {}
+
+    def save(self, data: Dict[str, Any], writes: Dict[str, Any]) -> None:
+        """Save the current data to the JSON file."""
+        path_tmp = f"{self.path}.tmp"
+        try:
+            # Serialize in one go without indentation, which allows `json` to use
+            # its C encoder instead of encoding the document chunk by chunk
+            data_json = json.dumps(data, ensure_ascii=False)
+            with open(path_tmp, "w", encoding="utf-8") as f:
+                f.write(data_json)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path_tmp, self.path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            raise RuntimeError(f"Failed to save data to {self.path}: {e}")
+
+
+class StorageSqlite:
+    """
+    Stores each key in a row of a SQLite table, with the value serialized as JSON.
+    A save only writes the changed keys, in a single SQLite transaction, which
+    is atomic even if the process is killed halfway through.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # The connection is shared by the threads using `UserFiles`, which
+        # serializes access to it with its lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "create table if not exists data (key text primary key, value text not null)"
+        )
+        self._connection.commit()
+
+    def load(self) -> Dict[str, Any]:
+        return {
+            key: json.loads(value)
+            for key, value in self._connection.execute("select key, value from data")
+        }
+
+    def save(self, data: Dict[str, Any], writes: Dict[str, Any]) -> None:
+        try:
+            with self._connection:
+                self._connection.executemany(
+                    "delete from data where key = ?",
+                    [(key,) for key, value in writes.items() if value is _DELETED],
+                )
+                self._connection.executemany(
+                    "insert or replace into data (key, value) values (?, ?)",
+                    [
+                        (key, json.dumps(value, ensure_ascii=False))
+                        for key, value in writes.items()
+                        if value is not _DELETED
+                    ],
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            raise RuntimeError(f"Failed to save data to {self.path}: {e}")
+
+
+Storage = Union[StorageJson, StorageSqlite]
 
 #:
 
 
 class UserFiles:
 
-    def __init__(self):
+    def __init__(self, storage: Optional[Storage] = None):
         path_addon = os.path.dirname(os.path.realpath(__file__))
         path_user_files = os.path.join(path_addon, "user_files")
 
         if not os.path.exists(path_user_files):
             raise FileNotFoundError(f"Directory '{path_user_files}' does not exist")
 
-        self.file_data_json = os.path.join(path_user_files, "data.json")
+        self._storage: Storage
+        if storage is not None:
+            self._storage = storage
+        else:
+            self._storage = StorageSqlite(os.path.join(path_user_files, "data.sqlite"))
         self._lock = threading.Lock()
         self._data: Dict[str, Any] = {}
+        # Keys of `_data` in sorted order, so that the keys with a given prefix
+        # are a contiguous range, see `get_prefix`
+        self._keys_sorted: List[str] = []
+        # Writes staged by the transaction open in the current thread, if any
+        self._local = threading.local()
         self._load_data()
+        self._migrate_data_json(os.path.join(path_user_files, "data.json"))
 
     def _load_data(self) -> None:
-        """Load data from the JSON file if it exists."""
-        if os.path.exists(self.file_data_json):
-            try:
-                with open(self.file_data_json, "r", encoding="utf-8") as f:
-                    self._data = json.load(f)
-            except (json.JSONDecodeError, IOError, OSError):
-                self._data = {}
-        else:
-            self._data = {}
+        self._data = self._storage.load()
+        self._keys_sorted = sorted(self._data)
 
-    def _save_data(self) -> None:
-        """Save the current data to the JSON file."""
+    def _migrate_data_json(self, path_data_json: str) -> None:
+        """
+        Previous versions of the add-on stored the data in `data.json`, copy it to
+        the storage on first load. The file is left in place, so that a previous
+        version of the add-on still finds it after a downgrade.
+        """
+        if isinstance(self._storage, StorageJson) or self._data:
+            return
+        if not os.path.exists(path_data_json):
+            return
+
+        data = StorageJson(path_data_json).load()
+        if not data:
+            return
+        with self._lock:
+            self._save_writes(data)
+
+    def _save_writes(self, writes: Dict[str, Any]) -> None:
+        """
+        Save the writes and apply them to the data, the lock must be held. If the
+        save fails, the data is left unchanged.
+        """
+        writes_changed: Dict[str, Any] = {}
+        for key, value in writes.items():
+            if value is _DELETED:
+                if key in self._data:
+                    writes_changed[key] = value
+            # Values mutated in place are the same object, save them anyway
+            elif (
+                key not in self._data
+                or self._data[key] is value
+                or self._data[key] != value
+            ):
+                writes_changed[key] = value
+        if not writes_changed:
+            return
+
+        data = self._data.copy()
+        for key, value in writes_changed.items():
+            if value is _DELETED:
+                del data[key]
+            else:
+                data[key] = value
+        self._storage.save(data, writes_changed)
+        self._data = data
+        self._update_keys_sorted(writes_changed)
+
+    def _update_keys_sorted(self, writes_changed: Dict[str, Any]) -> None:
+        keys_deleted = [key for key, value in writes_changed.items() if value is _DELETED]
+        keys_added = [
+            key
+            for key, value in writes_changed.items()
+            if value is not _DELETED and not self._has_key_sorted(key)
+        ]
+        if len(keys_deleted) + len(keys_added) > SIZE_MAX_UPDATE_KEYS_SORTED:
+            self._keys_sorted = sorted(self._data)
+            return
+        for key in keys_deleted:
+            ix = bisect.bisect_left(self._keys_sorted, key)
+            if ix < len(self._keys_sorted) and self._keys_sorted[ix] == key:
+                del self._keys_sorted[ix]
+        for key in keys_added:
+            bisect.insort(self._keys_sorted, key)
+
+    def _has_key_sorted(self, key: str) -> bool:
+        ix = bisect.bisect_left(self._keys_sorted, key)
+        return ix < len(self._keys_sorted) and self._keys_sorted[ix] == key
+
+    def _get_keys_prefix(self, prefix: str) -> List[str]:
+        """Keys of `_data` starting with prefix, the lock must be held."""
+        ix_start = bisect.bisect_left(self._keys_sorted, prefix)
+        ix_end = ix_start
+        while ix_end < len(self._keys_sorted) and self._keys_sorted[ix_end].startswith(
+            prefix
+        ):
+            ix_end += 1
+        return self._keys_sorted[ix_start:ix_end]
+
+    def _get_writes_transaction(self) -> Optional[Dict[str, Any]]:
+        return getattr(self._local, "writes", None)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Stage the writes made by the current thread in the block and save them to
+        file at once when the block exits. If the block raises, the writes are
+        discarded. Other threads don't see the staged writes. Nested transactions
+        are part of the outermost one.
+        """
+        if self._get_writes_transaction() is not None:
+            yield
+            return
+
+        self._local.writes = {}
+        self._local.callbacks = []
         try:
-            with open(self.file_data_json, "w", encoding="utf-8") as f:
-                json.dump(self._data, f, indent=2, ensure_ascii=False)
-        except (IOError, OSError, TypeError) as e:
-            raise RuntimeError(f"Failed to save data to {self.file_data_json}: {e}")
+            yield
+            writes = self._local.writes
+            callbacks = self._local.callbacks
+        finally:
+            self._local.writes = None
+            self._local.callbacks = None
+
+        if writes:
+            with self._lock:
+                self._save_writes(writes)
+        for callback in callbacks:
+            callback()
+
+    def call_after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback once the transaction open in the current thread is saved, or
+        right away if there is none. If the transaction is discarded, callback is
+        never called.
+        """
+        if self._get_writes_transaction() is not None:
+            self._local.callbacks.append(callback)
+            return
+        callback()
 
     def get(self, key: str, default: Any = None) -> Any:
         """Get a value for the given key, returning default if key doesn't exist."""
+        writes = self._get_writes_transaction()
+        if writes is not None and key in writes:
+            return default if writes[key] is _DELETED else writes[key]
         with self._lock:
             return self._data.get(key, default)
 
     def set(self, key: str, value: Any) -> None:
-        """Set a value for the given key and save to file."""
+        """Set a value for the given key and save to file, unless the value is unchanged."""
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            writes[key] = value
+            return
         with self._lock:
-            self._data[key] = value
-            self._save_data()
+            self._save_writes({key: value})
 
     def delete(self, key: str) -> None:
         """Delete a key-value pair if it exists."""
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            if self.has(key):
+                writes[key] = _DELETED
+            return
         with self._lock:
-            if key in self._data:
-                del self._data[key]
-                self._save_data()
+            self._save_writes({key: _DELETED})
 
     def get_all(self) -> Dict[str, Any]:
         """Get all key-value pairs."""
         with self._lock:
-            return self._data.copy()
+            data = self._data.copy()
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            for key, value in writes.items():
+                if value is _DELETED:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+        return data
+
+    def get_prefix(self, prefix: str) -> Dict[str, Any]:
+        """Get the key-value pairs whose key starts with prefix."""
+        with self._lock:
+            data = {key: self._data[key] for key in self._get_keys_prefix(prefix)}
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            for key, value in writes.items():
+                if not key.startswith(prefix):
+                    continue
+                if value is _DELETED:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+        return data
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Delete the key-value pairs whose key starts with prefix, saving once."""
+        self.replace_prefix(prefix, {})
+
+    def replace_prefix(self, prefix: str, data: Dict[str, Any]) -> None:
+        """
+        Replace the key-value pairs whose key starts with prefix with data, saving
+        once. All the keys in data must start with prefix.
+        """
+        for key in data:
+            if not key.startswith(prefix):
+                raise ValueError(f"Key '{key}' does not start with '{prefix}'")
+
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            for key in self.get_prefix(prefix):
+                if key not in data:
+                    writes[key] = _DELETED
+            writes.update(data)
+            return
+        with self._lock:
+            writes_prefix: Dict[str, Any] = {
+                key: _DELETED for key in self._get_keys_prefix(prefix) if key not in data
+            }
+            writes_prefix.update(data)
+            self._save_writes(writes_prefix)
 
     def clear(self) -> None:
         """Clear all data."""
+        writes = self._get_writes_transaction()
+        if writes is not None:
+            for key in self.get_all():
+                writes[key] = _DELETED
+            return
         with self._lock:
-            self._data.clear()
-            self._save_data()
+            self._save_writes({key: _DELETED for key in self._data})
 
     def has(self, key: str) -> bool:
         """Check if a key exists."""
+        writes = self._get_writes_transaction()
+        if writes is not None and key in writes:
+            return writes[key] is not _DELETED
         with self._lock:
             return key in self._data
@@ -3,6 +3,10 @@ from typing import Optional
 from . import user_files
 from .puller_client import Patch
 
+#: Constants
+
+PREFIX_KEY_USER = "User/"
+
 #:
 
 
@@ -14,6 +18,11 @@ class Users:
     ##: process_patch
 
     def process_patch(self, patch: Patch) -> None:
+        # Save the file once for the whole patch, instead of once per operation
+        with self._user_files.transaction():
+            self._process_patch(patch)
+
+    def _process_patch(self, patch: Patch) -> None:
         for ix, op in enumerate(patch):
 
             # clear
@@ -22,28 +31,26 @@ class Users:
                 if ix != 0:
                     raise RuntimeError(f"Unexpected 'clear' op in position {ix}")
                 # Clear all user data
-                for key in self._user_files.get_all():
-                    if key.startswith("User/"):
-                        self._user_files.delete(key)
+                self._user_files.delete_prefix(PREFIX_KEY_USER)
 
             # del
 
             if op["op"] == "del":
-                if not op["key"].startswith("User/"):
+                if not op["key"].startswith(PREFIX_KEY_USER):
                     continue
                 self._user_files.delete(op["key"])
 
             # put
 
             if op["op"] == "put":
-                if not op["key"].startswith("User/"):
+                if not op["key"].startswith(PREFIX_KEY_USER):
                     continue
                 self._user_files.set(op["key"], op["value"])
 
     ##: get_email_user
 
     def get_email_user(self, id_user: str) -> Optional[str]:
-        value = self._user_files.get(f"User/{id_user}")
+        value = self._user_files.get(f"{PREFIX_KEY_USER}{id_user}")
         if value is None:
             return None
 
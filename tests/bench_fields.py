@@ -0,0 +1,101 @@
+# Benchmark of the CPU time spent building the fields of a note of N cards, with
+# the model as created, with `CNT_TEMPLATES_INITIAL` "Card" fields, and grown to
+# `CNT_MAX_ANKI_CARDS`. The add-on reads the "Card" fields of the note and builds
+# its fields by ordinal, see `MaterializerFields`. For comparison, the benchmark
+# also times the name lookups the add-on used to do on a `Note`: one read of
+# each "Card" field, one write to clear it, and one write for each field set.
+#
+# Usage: python tests/bench_fields.py [N ...]
+
+import json
+import sys
+import time
+
+import fixtures
+from anki.notes import Note
+from rember import models, notes
+
+# Number of notes timed
+CNT_NOTES = 5000
+
+
+def make_fields_by_name(
+    note: Note,
+    cnt_fields_id_card: int,
+    id_remb: str,
+    content_remb: dict,
+    map_id_card_ix_field: dict[str, int],
+    field_data: str,
+) -> list[str]:
+    fields_id_card = [
+        note[models.NAME_FIELD_ID_CARD(ix_field)] for ix_field in range(cnt_fields_id_card)
+    ]
+    note[models.NAME_FIELD_LINK] = (
+        f"""<a href="https://rember.com/r/${id_remb}">Edit in Rember (Remb ${id_remb})</a>"""
+    )
+    note[models.NAME_FIELD_NOTE] = content_remb["note"]["text"]
+    note[models.NAME_FIELD_DATA] = field_data
+    for ix_field in range(cnt_fields_id_card):
+        note[models.NAME_FIELD_ID_CARD(ix_field)] = ""
+    for id_card, ix_field in map_id_card_ix_field.items():
+        note[models.NAME_FIELD_ID_CARD(ix_field)] = id_card
+    note[models.NAME_FIELD_MEDIA] = ""
+    assert len(fields_id_card) == cnt_fields_id_card
+    return note.fields
+
+
+def bench(cnt_cards: int, is_grown: bool) -> None:
+    col = fixtures.make_collection(fixtures.make_dir_temp())
+    _models = models.Models(col=col)
+    if is_grown:
+        _models.grow_model_rember(_models.get_model_rember(), models.CNT_MAX_ANKI_CARDS)
+    notetype = _models.get_model_rember()
+    cnt_fields_id_card = models.get_cnt_fields_id_card(notetype)
+
+    remb = fixtures.make_op_remb(0, cnt_cards=cnt_cards)["value"]
+    content_remb = remb["content"]
+    field_data = models.wrap_field_data(json.dumps(content_remb))
+    map_id_card_ix_field = {
+        crop["id"]: ix_field for ix_field, crop in enumerate(content_remb["crops"])
+    }
+    note = col.new_note(notetype)
+
+    time_start = time.perf_counter()
+    for _ in range(CNT_NOTES):
+        make_fields_by_name(
+            note,
+            cnt_fields_id_card,
+            remb["id"],
+            content_remb,
+            map_id_card_ix_field,
+            field_data,
+        )
+    duration_by_name = (time.perf_counter() - time_start) / CNT_NOTES
+
+    materializer_fields = notes.MaterializerFields(notetype)
+    fields = list(note.fields)
+    time_start = time.perf_counter()
+    for _ in range(CNT_NOTES):
+        materializer_fields.get_fields_id_card(fields)
+        fields = materializer_fields.make_fields(
+            remb["id"], content_remb, map_id_card_ix_field, field_data
+        )
+    duration_by_ordinal = (time.perf_counter() - time_start) / CNT_NOTES
+
+    assert fields == note.fields
+    print(
+        f"N={cnt_cards:>2} cards {cnt_fields_id_card:>3} templates"
+        f"  by name {duration_by_name * 1e6:6.1f}us/note"
+        f"  by ordinal {duration_by_ordinal * 1e6:5.1f}us/note"
+    )
+    col.close()
+
+
+def main() -> None:
+    for arg in sys.argv[1:] or ["3", "10"]:
+        bench(int(arg), is_grown=False)
+        bench(int(arg), is_grown=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Benchmark of the import of N rembs into a collection, see `Notes.process_patch`.
+#
+# The guids of the rembs are resolved from a map loaded once per pull, so the
+# time per remb should stay flat as N grows. For comparison, the benchmark also
+# times the lookup the add-on used to do for each put, two queries by guid on
+# the notes table, which has no index on guid and therefore scans the table.
+#
+# Usage: python tests/bench_guids.py [N ...]
+
+import sys
+import time
+
+import fixtures
+from rember import puller
+
+# Number of puts sampled to time the lookups by guid
+CNT_SAMPLE_LOOKUPS = 200
+
+
+def bench(cnt_rembs: int) -> None:
+    mw = fixtures.MainWindow(fixtures.make_collection(fixtures.make_dir_temp()))
+    _user_files = fixtures.make_user_files(fixtures.make_dir_temp())
+    logger = fixtures.Logger()
+
+    def process(ops: list) -> float:
+        time_start = time.perf_counter()
+        _notes = fixtures.make_notes(mw, _user_files, logger)
+        for ix_start in range(0, len(ops), puller.SIZE_BATCH_PATCH):
+            _notes.process_patch(ops[ix_start : ix_start + puller.SIZE_BATCH_PATCH])
+        _notes.complete_patch()
+        return time.perf_counter() - time_start
+
+    duration_create = process(
+        [fixtures.make_op_remb(ix) for ix in range(cnt_rembs)]
+    )
+    duration_update = process(
+        [fixtures.make_op_remb(ix, text="Edited") for ix in range(cnt_rembs)]
+    )
+
+    # The lookups done for each put before the map, extrapolated to N puts
+    db = mw.col.db
+    time_start = time.perf_counter()
+    for ix in range(CNT_SAMPLE_LOOKUPS):
+        guid = f"r{ix * cnt_rembs // CNT_SAMPLE_LOOKUPS}"
+        db.scalar("select id from notes where guid = ?", guid)
+        db.scalar("select mid from notes where guid = ?", guid)
+    duration_lookups = (
+        (time.perf_counter() - time_start) / CNT_SAMPLE_LOOKUPS * cnt_rembs
+    )
+
+    print(
+        f"N={cnt_rembs:>7}"
+        f"  create {duration_create:7.2f}s ({duration_create / cnt_rembs * 1e6:5.0f}us/remb)"
+        f"  update {duration_update:7.2f}s ({duration_update / cnt_rembs * 1e6:5.0f}us/remb)"
+        f"  lookups by guid {duration_lookups:7.2f}s ({duration_lookups / cnt_rembs * 1e6:5.0f}us/remb)"
+    )
+    mw.col.close()
+
+
+def main() -> None:
+    for arg in sys.argv[1:] or ["1000", "10000", "50000"]:
+        bench(int(arg))
+
+
+if __name__ == "__main__":
+    fixtures.run_in_background(main)
@@ -0,0 +1,49 @@
+# Benchmark of the first import of N rembs of 3 cards into an empty collection,
+# creating the notes one at a time with `add_notes` and with Anki's bulk import
+# of foreign notes, enabled by the `import_bulk_rembs` option, see
+# `Notes._import_rembs_bulk`. The rembs are processed in batches of
+# `SIZE_BATCH_PATCH`, as in a pull.
+#
+# Usage: python tests/bench_import_bulk.py [N ...]
+
+import sys
+import time
+
+import fixtures
+from rember import puller
+
+
+def bench(cnt_rembs: int, is_import_bulk: bool) -> None:
+    mw = fixtures.MainWindow(
+        fixtures.make_collection(fixtures.make_dir_temp()),
+        config={"import_bulk_rembs": is_import_bulk},
+    )
+    _user_files = fixtures.make_user_files(fixtures.make_dir_temp())
+    logger = fixtures.Logger()
+    ops = [fixtures.make_op_remb(ix, cnt_cards=3) for ix in range(cnt_rembs)]
+
+    time_start = time.perf_counter()
+    _notes = fixtures.make_notes(mw, _user_files, logger)
+    for ix_start in range(0, len(ops), puller.SIZE_BATCH_PATCH):
+        _notes.process_patch(ops[ix_start : ix_start + puller.SIZE_BATCH_PATCH])
+    _notes.complete_patch()
+    duration = time.perf_counter() - time_start
+
+    cnt_notes = mw.col.note_count()
+    cnt_cards = mw.col.card_count()
+    print(
+        f"N={cnt_rembs:>7} {'bulk import' if is_import_bulk else 'add_notes':<11}"
+        f"  {duration:7.2f}s ({cnt_rembs / duration:6.0f} rembs/s)"
+        f"  {cnt_notes} notes, {cnt_cards} cards"
+    )
+    mw.col.close()
+
+
+def main() -> None:
+    for arg in sys.argv[1:] or ["10000", "100000"]:
+        bench(int(arg), is_import_bulk=False)
+        bench(int(arg), is_import_bulk=True)
+
+
+if __name__ == "__main__":
+    fixtures.run_in_background(main)
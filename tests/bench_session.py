@@ -0,0 +1,69 @@
+# Benchmark of the requests made by a sync, which refreshes the auth tokens and
+# then pulls, see `Puller._pull_op`. The add-on sends both requests with the
+# shared keep-alive session of `session_http`, the add-on used to send each one
+# with `requests.post`, which opens a new connection for every request.
+#
+# By default the requests go to a stand-in server on localhost, which counts the
+# connections opened. Pass a URL to time HEAD requests to a remote server
+# instead, where each new connection pays the TCP and TLS handshakes.
+#
+# Usage: python tests/bench_session.py [URL]
+
+import sys
+import time
+from typing import Callable, Optional
+
+import fixtures
+import requests
+from rember import session_http
+
+# Number of syncs timed, each sends 2 requests
+CNT_SYNCS = 20
+
+
+def bench(name: str, send: Callable[[], None], server: Optional[fixtures.ServerReplicache]) -> None:
+    cnt_connections_start = server.cnt_connections if server is not None else 0
+    time_start = time.perf_counter()
+    for _ in range(CNT_SYNCS):
+        send()
+        send()
+    duration = time.perf_counter() - time_start
+    info_connections = (
+        f"  {server.cnt_connections - cnt_connections_start} connections"
+        if server is not None
+        else ""
+    )
+    print(f"{name:<16} {duration / CNT_SYNCS * 1000:7.1f}ms/sync{info_connections}")
+
+
+def main() -> None:
+    url = sys.argv[1] if len(sys.argv) > 1 else None
+    server = None
+    if url is None:
+        server = fixtures.ServerReplicache([fixtures.make_op_remb(0)])
+        url = server.url
+
+    def send_post() -> None:
+        if server is not None:
+            requests.post(url, json={"cookie": 1}, timeout=session_http.TIMEOUT)
+        else:
+            requests.head(url, timeout=session_http.TIMEOUT)
+
+    def send_session() -> None:
+        if server is not None:
+            session_http.get_session().post(
+                url, json={"cookie": 1}, timeout=session_http.TIMEOUT
+            )
+        else:
+            session_http.get_session().head(url, timeout=session_http.TIMEOUT)
+
+    bench("new connections", send_post, server)
+    bench("shared session", send_session, server)
+
+    session_http.close_session()
+    if server is not None:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Benchmark of the cost the add-on adds to Anki's launch. Anki has already
+# imported `anki` and `aqt` when it loads the add-on, which then imports its
+# modules, see `src/__init__.py`. The user files, the logger and the services
+# built on them are created later, when the first profile opens, see `init` in
+# `src/__init__.py`. The benchmark times both steps, and lists the HTTP libraries
+# imported by the modules, which should be imported only on the first pull.
+#
+# Run it in a fresh interpreter, the imports are timed once.
+#
+# Usage: python tests/bench_startup.py [N ...]
+#   N: number of keys in the user files, e.g. quarantined rembs
+
+import importlib
+import os
+import sys
+import tempfile
+import time
+import types
+
+# Modules imported by `src/__init__.py`
+MODULES_ADDON = [
+    "auth",
+    "auth_tokens",
+    "decks",
+    "info",
+    "logger",
+    "models",
+    "puller",
+    "puller_cookie_collection",
+    "puller_cookie_replicache",
+    "puller_rembs_cleared",
+    "quarantine_rembs",
+    "session_http",
+    "user_files",
+    "users",
+]
+
+MODULES_HTTP = ["requests", "urllib3", "msgpack"]
+
+PATH_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def bench_import() -> None:
+    # Imported by Anki before the add-ons
+    import anki.collection  # noqa: F401
+    import aqt  # noqa: F401
+
+    modules_anki = set(sys.modules)
+    package = types.ModuleType("rember")
+    package.__path__ = [PATH_SRC]
+    sys.modules["rember"] = package
+
+    time_start = time.perf_counter()
+    for name in MODULES_ADDON:
+        importlib.import_module(f"rember.{name}")
+    duration = time.perf_counter() - time_start
+
+    modules_http = [
+        name for name in MODULES_HTTP if name in sys.modules and name not in modules_anki
+    ]
+    print(
+        f"import {duration * 1000:7.1f}ms"
+        f"  HTTP libraries imported: {', '.join(modules_http) or 'none'}"
+    )
+
+
+def bench_init(cnt_keys: int) -> None:
+    from rember import (
+        info,
+        logger,
+        puller_cookie_replicache,
+        puller_rembs_cleared,
+        quarantine_rembs,
+        user_files,
+    )
+
+    path_data = os.path.join(tempfile.mkdtemp(), "data.sqlite")
+    _user_files = user_files.UserFiles(storage=user_files.StorageSqlite(path_data))
+    with _user_files.transaction():
+        _user_files.set("version_rember_anki_sync", info.VERSION_REMBER_ANKI_SYNC)
+        for ix in range(cnt_keys):
+            _user_files.set(
+                f"QuarantineRemb/r{ix}", {"value": {"id": f"r{ix}"}, "error": "Error"}
+            )
+
+    # The steps of `init`, except the auth state, which needs the main window
+    time_start = time.perf_counter()
+    _user_files = user_files.UserFiles(storage=user_files.StorageSqlite(path_data))
+    _user_files.set("version_rember_anki_sync", info.VERSION_REMBER_ANKI_SYNC)
+    _logger = logger.Logger(user_files=_user_files)
+    puller_cookie_replicache.CookieReplicache(
+        user_files=_user_files, callback_set=_logger.set_cookie_replicache
+    )
+    puller_rembs_cleared.RembsCleared(user_files=_user_files)
+    quarantine_rembs.QuarantineRembs(user_files=_user_files)
+    duration = time.perf_counter() - time_start
+
+    print(f"init   {duration * 1000:7.1f}ms  N={cnt_keys} keys in the user files")
+    _logger.close()
+
+
+def main() -> None:
+    bench_import()
+    for arg in sys.argv[1:] or ["0", "1000", "10000"]:
+        bench_init(int(arg))
+
+
+if __name__ == "__main__":
+    main()
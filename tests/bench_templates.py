@@ -0,0 +1,57 @@
+# Benchmark of the creation and the update of N rembs of 3 cards, with the
+# "Rember 0.2.0" model as created, with `CNT_TEMPLATES_INITIAL` templates, and
+# once grown to `CNT_MAX_ANKI_CARDS` templates, which is also the size of the
+# "Rember 0.1.0" model. Anki renders every template of the model when it
+# generates the cards of a note, see `Models.grow_model_rember`.
+#
+# Usage: python tests/bench_templates.py [N ...]
+
+import sys
+import time
+
+import fixtures
+from rember import models, puller
+
+
+def bench(cnt_rembs: int, is_grown: bool) -> None:
+    mw = fixtures.MainWindow(fixtures.make_collection(fixtures.make_dir_temp()))
+    _user_files = fixtures.make_user_files(fixtures.make_dir_temp())
+    logger = fixtures.Logger()
+    _models = models.Models(col=mw.col)
+    if is_grown:
+        _models.grow_model_rember(
+            _models.get_model_rember(), models.CNT_MAX_ANKI_CARDS
+        )
+    cnt_templates = models.get_cnt_fields_id_card(_models.get_model_rember())
+
+    def process(ops: list) -> float:
+        time_start = time.perf_counter()
+        _notes = fixtures.make_notes(mw, _user_files, logger)
+        for ix_start in range(0, len(ops), puller.SIZE_BATCH_PATCH):
+            _notes.process_patch(ops[ix_start : ix_start + puller.SIZE_BATCH_PATCH])
+        _notes.complete_patch()
+        return time.perf_counter() - time_start
+
+    duration_create = process(
+        [fixtures.make_op_remb(ix, cnt_cards=3) for ix in range(cnt_rembs)]
+    )
+    duration_update = process(
+        [fixtures.make_op_remb(ix, cnt_cards=3, text="Edited") for ix in range(cnt_rembs)]
+    )
+
+    print(
+        f"N={cnt_rembs:>6} {cnt_templates:>3} templates"
+        f"  create {duration_create:6.2f}s ({cnt_rembs / duration_create:6.0f} rembs/s)"
+        f"  update {duration_update:6.2f}s ({cnt_rembs / duration_update:6.0f} rembs/s)"
+    )
+    mw.col.close()
+
+
+def main() -> None:
+    for arg in sys.argv[1:] or ["1000", "5000"]:
+        bench(int(arg), is_grown=False)
+        bench(int(arg), is_grown=True)
+
+
+if __name__ == "__main__":
+    fixtures.run_in_background(main)
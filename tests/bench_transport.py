@@ -0,0 +1,72 @@
+# Benchmark of the transport of a pull of N rembs from a stand-in server on
+# localhost, with the response compressed with gzip and with plain JSON. Reports
+# the bytes on the wire, the decoded bytes and the time to receive and decode
+# the patch, see `puller_client.replicache_pull_for_anki`. On localhost the
+# transfer is almost free and the time includes compressing the response on the
+# server, the time to transfer the bytes on a 10 Mbit/s link is reported
+# separately.
+#
+# Usage: python tests/bench_transport.py [N ...]
+
+import random
+import sys
+import time
+
+import fixtures
+from rember import metrics, puller_client, session_http
+
+
+# Bits per second of the link used to estimate the transfer time
+BANDWIDTH_LINK = 10e6
+
+WORDS = "the of and to in is that for it as with was on be by this are from".split()
+
+
+def make_text(random_text: random.Random) -> str:
+    """A note of 40 words, half of them random, so that the patch doesn't
+    compress better than the notes of real rembs."""
+    return " ".join(
+        random_text.choice(WORDS)
+        if random_text.random() < 0.5
+        else f"{random_text.getrandbits(24):x}"
+        for _ in range(40)
+    )
+
+
+def bench(cnt_rembs: int, is_gzip: bool) -> None:
+    random_text = random.Random(0)
+    server = fixtures.ServerReplicache(
+        [
+            fixtures.make_op_remb(ix, cnt_cards=3, text=make_text(random_text))
+            for ix in range(cnt_rembs)
+        ]
+    )
+    server.is_gzip = is_gzip
+    fixtures.use_server(server)
+
+    _metrics = metrics.Metrics()
+    time_start = time.perf_counter()
+    result = puller_client.replicache_pull_for_anki(
+        cookie_replicache=None, token_access="access", metrics=_metrics
+    )
+    assert result._tag == "Success"
+    cnt_ops = sum(1 for _ in result.patch)
+    duration = time.perf_counter() - time_start
+    counters = _metrics.to_record()["counters"]
+
+    print(
+        f"N={cnt_rembs:>6} {'gzip' if is_gzip else 'json':<4}"
+        f"  wire {counters['bytes_response_wire'] / 1e6:6.2f}MB"
+        f"  decoded {counters['bytes_response'] / 1e6:6.2f}MB"
+        f"  receive and decode {duration * 1000:6.0f}ms ({cnt_ops} ops)"
+        f"  transfer at 10 Mbit/s"
+        f" {counters['bytes_response_wire'] * 8 / BANDWIDTH_LINK * 1000:6.0f}ms"
+    )
+    session_http.close_session()
+    server.close()
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:] or ["1000", "10000"]:
+        bench(int(arg), is_gzip=False)
+        bench(int(arg), is_gzip=True)
@@ -0,0 +1,102 @@
+# Benchmark of the user files written by a pull page of N `User/` operations,
+# see `Users.process_patch`. The page starts with a `clear`, as a pull from
+# scratch, and the user files already hold other keys, like the quarantined
+# rembs and the pull metrics. Each save of `StorageJson` rewrites the whole file,
+# each save of `StorageSqlite` writes the changed keys.
+#
+# The add-on saves the page and the cookie in a single `UserFiles.transaction`.
+# For comparison, the benchmark also applies the page without a transaction, the
+# add-on used to save once per operation and once more for the cookie.
+#
+# Usage: python tests/bench_user_files.py [N ...]
+
+import json
+import os
+import sys
+import time
+from typing import Any, Dict
+
+import fixtures
+from rember import puller_cookie_replicache, user_files, users
+
+# Number of other keys in the user files
+CNT_KEYS_OTHER = 1000
+
+
+class StorageCounted:
+    """Counts the saves of a storage and the bytes they write."""
+
+    def __init__(self, storage: user_files.Storage):
+        self._storage = storage
+        self.cnt_saves = 0
+        self.bytes_written = 0
+
+    def load(self) -> Dict[str, Any]:
+        return self._storage.load()
+
+    def save(self, data: Dict[str, Any], writes: Dict[str, Any]) -> None:
+        self._storage.save(data, writes)
+        self.cnt_saves += 1
+        if isinstance(self._storage, user_files.StorageJson):
+            self.bytes_written += os.path.getsize(self._storage.path)
+        else:
+            self.bytes_written += sum(
+                len(key) + len(json.dumps(value, ensure_ascii=False))
+                for key, value in writes.items()
+                if value is not user_files._DELETED
+            )
+
+
+def make_storage(name: str) -> user_files.Storage:
+    path_dir = fixtures.make_dir_temp()
+    if name == "json":
+        return user_files.StorageJson(os.path.join(path_dir, "data.json"))
+    return user_files.StorageSqlite(os.path.join(path_dir, "data.sqlite"))
+
+
+def bench(cnt_ops: int, name_storage: str, is_transaction: bool) -> None:
+    storage = StorageCounted(make_storage(name_storage))
+    _user_files = user_files.UserFiles(storage=storage)  # type: ignore[arg-type]
+    with _user_files.transaction():
+        for ix in range(CNT_KEYS_OTHER):
+            _user_files.set(
+                f"QuarantineRemb/r{ix}", {"value": {"id": f"r{ix}"}, "error": "Error"}
+            )
+    storage.cnt_saves = 0
+    storage.bytes_written = 0
+
+    patch = [{"op": "clear"}] + [
+        {"op": "put", "key": f"User/u{ix}", "value": {"email": f"u{ix}@rember.com"}}
+        for ix in range(cnt_ops)
+    ]
+    _users = users.Users(user_files=_user_files)
+    cookies_replicache = puller_cookie_replicache.CookieReplicache(
+        user_files=_user_files
+    )
+
+    time_start = time.perf_counter()
+    if is_transaction:
+        with _user_files.transaction():
+            _users.process_patch(patch)
+            cookies_replicache.set(1)
+    else:
+        _users._process_patch(patch)
+        cookies_replicache.set(1)
+    duration = time.perf_counter() - time_start
+
+    print(
+        f"N={cnt_ops:>5} {name_storage:<6} {'transaction' if is_transaction else 'per operation':<13}"
+        f"  {storage.cnt_saves:5} saves  {storage.bytes_written / 1e3:9.1f}kB written"
+        f"  {duration * 1000:7.0f}ms"
+    )
+
+
+def main() -> None:
+    for arg in sys.argv[1:] or ["10", "100", "1000"]:
+        for name_storage in ["json", "sqlite"]:
+            bench(int(arg), name_storage, is_transaction=False)
+            bench(int(arg), name_storage, is_transaction=True)
+
+
+if __name__ == "__main__":
+    main()
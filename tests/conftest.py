@@ -0,0 +1,52 @@
+import fixtures
+import pytest
+from anki.collection import Collection
+from rember import puller as puller_
+from rember import puller_client, session_http
+from rember import user_files as user_files_
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch):
+    server = fixtures.ServerReplicache()
+    monkeypatch.setattr(puller_client, "ENDPOINT_REPLICACHE_PULL_FOR_ANKI", server.url)
+    yield server
+    session_http.close_session()
+    server.close()
+
+
+@pytest.fixture
+def col(tmp_path):
+    col = fixtures.make_collection(str(tmp_path))
+    yield col
+    col.close()
+
+
+@pytest.fixture
+def mw(col: Collection):
+    mw = fixtures.MainWindow(col)
+    yield mw
+    # The test might have replaced the collection
+    mw.col.close()
+
+
+@pytest.fixture
+def user_files(tmp_path) -> user_files_.UserFiles:
+    return fixtures.make_user_files(str(tmp_path))
+
+
+@pytest.fixture
+def logger() -> fixtures.Logger:
+    return fixtures.Logger()
+
+
+@pytest.fixture
+def puller(
+    mw: fixtures.MainWindow,
+    user_files: user_files_.UserFiles,
+    logger: fixtures.Logger,
+    server: fixtures.ServerReplicache,
+) -> puller_.Puller:
+    return puller_.Puller(
+        mw=mw, auth=fixtures.Auth(), user_files=user_files, logger=logger
+    )
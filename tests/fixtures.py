@@ -0,0 +1,276 @@
+# Helpers shared by the tests and the benchmarks in this folder. They run the
+# modules of the add-on against a temporary collection and a stand-in Rember
+# server, outside of Anki.
+
+import base64
+import concurrent.futures
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from anki.collection import Collection
+
+#: Add-on
+
+# Anki imports the add-on as a package and runs `src/__init__.py`, which sets up
+# the main window. The modules are loaded as submodules of an empty "rember"
+# package instead, so that `__init__.py` doesn't run.
+PATH_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+if "rember" not in sys.modules:
+    _package = types.ModuleType("rember")
+    _package.__path__ = [PATH_SRC]
+    sys.modules["rember"] = _package
+
+from rember import (  # noqa: E402
+    auth_client,
+    auth_tokens,
+    decks,
+    metrics,
+    models,
+    notes,
+    puller_client,
+    quarantine_rembs,
+    user_files,
+)
+
+#: Anki
+
+
+class AddonManager:
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or {}
+
+    def addonFromModule(self, module: str) -> str:
+        return "rember"
+
+    def getConfig(self, module: str) -> dict:
+        return self.config
+
+
+class MainWindow:
+    """The attributes of `aqt.main.AnkiQt` used by the add-on modules."""
+
+    def __init__(self, col: Collection, config: Optional[dict] = None):
+        self.col = col
+        self.addonManager = AddonManager(config)
+
+
+def make_collection(path_dir: str) -> Collection:
+    """A new collection with the Rember model and deck, as created when the add-on loads."""
+    col = Collection(os.path.join(path_dir, "collection.anki2"))
+    # The cached ids belong to the previous collection
+    models.clear_cache_model_rember()
+    decks.clear_cache_deck_rember()
+    models.Models(col=col).create_model_rember()
+    decks.Decks(col=col).create_deck_rember()
+    return col
+
+
+def make_user_files(path_dir: str) -> user_files.UserFiles:
+    return user_files.UserFiles(
+        storage=user_files.StorageSqlite(os.path.join(path_dir, "data.sqlite"))
+    )
+
+
+#: Add-on services
+
+
+class Logger:
+    """Keeps the messages in memory instead of writing rember.log."""
+
+    def __init__(self):
+        self.messages: list[tuple[str, str]] = []
+        self.cookie_replicache: Optional[int] = None
+
+    def info(self, message: str, mw: Any = None) -> None:
+        self.messages.append(("info", message))
+
+    def warn(self, message: str, mw: Any = None) -> None:
+        self.messages.append(("warn", message))
+
+    def error(self, message: str, mw: Any = None, exception: Any = None) -> None:
+        self.messages.append(("error", f"{message} {exception}"))
+
+    def set_token_access(self, token_access: Optional[str]) -> None:
+        pass
+
+    def set_cookie_replicache(self, cookie_replicache: Optional[int]) -> None:
+        self.cookie_replicache = cookie_replicache
+
+
+ID_USER = "u0"
+
+
+def make_token_access(id_user: str = ID_USER) -> str:
+    """An access token with the claims read by `auth_tokens.decode_token_access`."""
+    payload = json.dumps({"exp": 2**31, "properties": {"idUser": id_user}})
+    payload_b64 = base64.urlsafe_b64encode(payload.encode("utf-8")).decode("utf-8")
+    return f"header.{payload_b64.rstrip('=')}.signature"
+
+
+class _StateSignedIn:
+    def __init__(self):
+        self._tag = "SignedIn"
+        self.tokens = auth_tokens.Tokens(access=make_token_access(), refresh="refresh")
+
+
+class Auth:
+    """Signed in, the tokens never need to be refreshed."""
+
+    def __init__(self):
+        self.state = _StateSignedIn()
+
+    def refresh_tokens(self) -> auth_client.SuccessRefresh:
+        return auth_client.SuccessRefresh(tokens=None)
+
+
+def make_notes(
+    mw: MainWindow, user_files: user_files.UserFiles, logger: Logger
+) -> notes.Notes:
+    """The processor of the remb operations of a pull, as created by `Puller`."""
+    return notes.Notes(
+        mw=mw,
+        col=mw.col,
+        models=models.Models(col=mw.col),
+        decks=decks.Decks(col=mw.col),
+        logger=logger,
+        quarantine_rembs=quarantine_rembs.QuarantineRembs(user_files=user_files),
+        metrics=metrics.Metrics(),
+    )
+
+
+#: Rembs
+
+
+def make_op_remb(ix: int, cnt_cards: int = 2, text: str = "Note") -> dict:
+    """A put operation for the remb `r{ix}` with `cnt_cards` cards."""
+    return {
+        "op": "put",
+        "key": f"Remb/r{ix}",
+        "value": {
+            "id": f"r{ix}",
+            "content": {
+                "note": {"text": f"{text} {ix}"},
+                "crops": [{"id": f"c{ix_card}", "type": "qa"} for ix_card in range(cnt_cards)],
+            },
+        },
+    }
+
+
+#: Server
+
+
+class ServerReplicache:
+    """
+    Stand-in for the replicache-pull-for-anki endpoint. The state of the account
+    is the list of operations of a full pull, the cookie is an offset in the
+    list. A pull from cookie None starts with a `clear` operation. The server
+    splits the operations in pages of `sizePageMax` operations, unless
+    `is_paginated` is False, like a server that ignores `sizePageMax`. Responses
+    are compressed with gzip if the client accepts it and `is_gzip` is True.
+    """
+
+    def __init__(self, ops: Optional[list] = None):
+        self.ops: list = ops or []
+        self.is_paginated = True
+        self.is_gzip = True
+        # Offset of the first operation of the page after which requests fail
+        self.offset_failure: Optional[int] = None
+        self.requests: list[dict] = []
+        self.cnt_connections = 0
+        self.bytes_sent = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # The headers and the body are sent separately, with Nagle's
+            # algorithm the body of a response on a kept-alive connection waits
+            # for the client to acknowledge the headers
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                super().setup()
+                server.cnt_connections += 1
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                length = int(self.headers["content-length"])
+                payload = json.loads(self.rfile.read(length))
+                server.requests.append(
+                    {
+                        "payload": payload,
+                        "headers": {
+                            name.lower(): value for name, value in self.headers.items()
+                        },
+                    }
+                )
+                body = json.dumps(server.make_response(payload)).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                if server.is_gzip and "gzip" in self.headers.get("accept-encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("content-encoding", "gzip")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                # Counted before writing, the client can read the counter as
+                # soon as it receives the body
+                server.bytes_sent += len(body)
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}/"
+
+    def make_response(self, payload: dict) -> dict:
+        offset_start = payload["cookie"] or 0
+        offset_end = len(self.ops)
+        if self.is_paginated and "sizePageMax" in payload:
+            offset_end = min(offset_start + payload["sizePageMax"], len(self.ops))
+
+        if self.offset_failure is not None and offset_start >= self.offset_failure:
+            # An invalid operation, which fails the processing of the page
+            return {"patch": [{"op": "put"}], "cookie": offset_end}
+
+        patch = [{"op": "clear"}] if payload["cookie"] is None else []
+        patch += self.ops[offset_start:offset_end]
+        response = {"cookie": offset_end, "patch": patch}
+        if self.is_paginated and "sizePageMax" in payload:
+            response["hasMore"] = offset_end < len(self.ops)
+        return response
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def use_server(server: ServerReplicache) -> None:
+    """Send the pulls to the stand-in server."""
+    puller_client.ENDPOINT_REPLICACHE_PULL_FOR_ANKI = server.url
+
+
+#: Benchmarks
+
+
+def make_dir_temp() -> str:
+    return tempfile.mkdtemp(prefix="rember-anki-sync-")
+
+
+def run_in_background(function: Callable[[], None]) -> None:
+    """
+    Run in a background thread, where Anki runs the pulls, see `Puller.pull`.
+    On the main thread Anki prints a stack trace for each slow backend call.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(function).result()
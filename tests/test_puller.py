@@ -0,0 +1,180 @@
+import json
+import shutil
+
+import fixtures
+import pytest
+from anki.collection import Collection
+from rember import decks, models, notes, puller_client, puller_cookie_collection
+
+
+def count_notes_rember(col) -> int:
+    return col.db.scalar("select count() from notes where guid like 'r%'")
+
+
+def test_pull_pages(monkeypatch, puller, server, mw, user_files):
+    monkeypatch.setattr(puller_client, "SIZE_PAGE_MAX", 10)
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(25)]
+
+    puller._pull_op()
+
+    assert [request["payload"]["cookie"] for request in server.requests] == [None, 10, 20]
+    assert all(request["payload"]["sizePageMax"] == 10 for request in server.requests)
+    assert count_notes_rember(mw.col) == 25
+    assert user_files.get("cookie_replicache") == 25
+
+
+def test_pull_server_without_pagination(monkeypatch, puller, server, mw, user_files, logger):
+    monkeypatch.setattr(puller_client, "SIZE_PAGE_MAX", 10)
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(25)]
+    server.is_paginated = False
+
+    puller._pull_op()
+
+    assert len(server.requests) == 1
+    assert count_notes_rember(mw.col) == 25
+    assert user_files.get("cookie_replicache") == 25
+    assert (
+        "info",
+        "Server doesn't paginate, the patch was pulled in a single page",
+    ) in logger.messages
+
+
+def test_pull_page_failed(monkeypatch, puller, server, mw, user_files, logger):
+    monkeypatch.setattr(puller_client, "SIZE_PAGE_MAX", 10)
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(25)]
+    server.offset_failure = 10
+
+    with pytest.raises(Exception):
+        puller._pull_op()
+
+    # The cookie stays at the last page saved, and is reported only once saved
+    assert user_files.get("cookie_replicache") == 10
+    assert logger.cookie_replicache == 10
+
+    server.offset_failure = None
+    puller._pull_op()
+
+    assert [request["payload"]["cookie"] for request in server.requests] == [
+        None,
+        10,
+        10,
+        20,
+    ]
+    assert count_notes_rember(mw.col) == 25
+    assert logger.cookie_replicache == 25
+
+
+def mark_synced(col: Collection) -> None:
+    """Mark the schema as synced with AnkiWeb, a new collection needs a full sync."""
+    col.db.execute("update col set ls = scm")
+
+
+def copy_collection(mw, path: str) -> None:
+    path_col = mw.col.path
+    mw.col.close()
+    shutil.copy(path_col, path)
+    mw.col = Collection(path_col)
+
+
+def replace_collection(mw, path: str) -> None:
+    """Replace the collection with a copy, like a full sync that downloads it."""
+    path_col = mw.col.path
+    mw.col.close()
+    shutil.copy(path, path_col)
+    mw.col = Collection(path_col)
+    models.clear_cache_model_rember()
+    decks.clear_cache_deck_rember()
+
+
+def test_grow_model(puller, server, mw, user_files):
+    mark_synced(mw.col)
+    server.ops = [fixtures.make_op_remb(0, cnt_cards=11)]
+
+    puller._pull_op()
+
+    # The model grows once to the max, which forces a single full sync
+    notetype = models.Models(col=mw.col).get_model_rember()
+    assert models.get_cnt_fields_id_card(notetype) == models.CNT_MAX_ANKI_CARDS
+    assert mw.col.schema_changed()
+    assert user_files.get("cookie_replicache") == 1
+
+    # The cookie keeps advancing while the full sync is pending, e.g. if the
+    # user cancels it
+    server.ops.append(fixtures.make_op_remb(1, cnt_cards=50))
+    puller._pull_op()
+
+    assert server.requests[-1]["payload"]["cookie"] == 1
+    assert user_files.get("cookie_replicache") == 2
+    assert models.Models(col=mw.col).get_model_rember()["mod"] == notetype["mod"]
+    assert count_notes_rember(mw.col) == 2
+
+
+def test_sync_full_upload(puller, server, mw, user_files):
+    server.ops = [fixtures.make_op_remb(0, cnt_cards=11)]
+    puller._pull_op()
+
+    # A full upload leaves the collection as it is
+    mark_synced(mw.col)
+    puller.restore_cookie_from_collection()
+
+    assert user_files.get("cookie_replicache") == 1
+    server.ops.append(fixtures.make_op_remb(1))
+    puller._pull_op()
+    assert server.requests[-1]["payload"]["cookie"] == 1
+
+
+def test_sync_full_download(tmp_path, puller, server, mw, user_files, logger):
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(10)]
+    puller._pull_op()
+    # The collection uploaded to AnkiWeb
+    path_ankiweb = str(tmp_path / "ankiweb.anki2")
+    copy_collection(mw, path_ankiweb)
+
+    server.ops.append(fixtures.make_op_remb(10, cnt_cards=11))
+    server.ops += [fixtures.make_op_remb(ix) for ix in range(11, 15)]
+    puller._pull_op()
+    assert count_notes_rember(mw.col) == 15
+    assert user_files.get("cookie_replicache") == 15
+
+    # The full sync downloads the collection from AnkiWeb, which has the notes
+    # and the cookie of the first pull
+    replace_collection(mw, path_ankiweb)
+    puller.restore_cookie_from_collection()
+
+    assert user_files.get("cookie_replicache") == 10
+    assert logger.cookie_replicache == 10
+    puller._pull_op()
+    assert server.requests[-1]["payload"]["cookie"] == 10
+    assert count_notes_rember(mw.col) == 15
+
+
+def test_restore_cookie_other_user(puller, server, mw, user_files):
+    server.ops = [fixtures.make_op_remb(0)]
+    puller._pull_op()
+    puller_cookie_collection.CookieCollection(col=mw.col).set(7, "u1")
+
+    puller.restore_cookie_from_collection()
+
+    assert user_files.get("cookie_replicache") == 1
+
+
+def test_import_bulk_then_update(puller, server, mw, logger):
+    mw.addonManager = fixtures.AddonManager({"import_bulk_rembs": True})
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(notes.SIZE_MIN_IMPORT_BULK)]
+    puller._pull_op()
+    assert count_notes_rember(mw.col) == notes.SIZE_MIN_IMPORT_BULK
+
+    server.ops.append(fixtures.make_op_remb(0, text="Edited"))
+    puller._pull_op()
+
+    # The update finds the note created by the bulk import
+    ids_note = mw.col.db.list("select id from notes where guid = ?", "r0")
+    assert len(ids_note) == 1
+    assert "Edited 0" in mw.col.get_note(ids_note[0])[models.NAME_FIELD_NOTE]
+    assert count_notes_rember(mw.col) == notes.SIZE_MIN_IMPORT_BULK
+    records = [
+        json.loads(message[len("Pull metrics: ") :])
+        for _, message in logger.messages
+        if message.startswith("Pull metrics: ")
+    ]
+    assert records[0]["counters"]["rembs_imported_bulk"] == notes.SIZE_MIN_IMPORT_BULK
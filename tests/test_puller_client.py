@@ -0,0 +1,34 @@
+import fixtures
+from rember import metrics, puller_client
+
+
+def pull(cookie_replicache=None):
+    _metrics = metrics.Metrics()
+    result = puller_client.replicache_pull_for_anki(
+        cookie_replicache=cookie_replicache, token_access="access", metrics=_metrics
+    )
+    assert result._tag == "Success"
+    patch = list(result.patch)
+    return result, patch, _metrics.to_record()["counters"]
+
+
+def test_response_gzip(server):
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(100)]
+
+    result, patch, counters = pull()
+
+    assert "gzip" in server.requests[-1]["headers"]["accept-encoding"]
+    assert patch == [{"op": "clear"}, *server.ops]
+    assert result.cookie == 100
+    assert counters["bytes_response_wire"] == server.bytes_sent
+    assert counters["bytes_response_wire"] < counters["bytes_response"]
+
+
+def test_response_identity(server):
+    server.ops = [fixtures.make_op_remb(ix) for ix in range(100)]
+    server.is_gzip = False
+
+    result, patch, counters = pull()
+
+    assert patch == [{"op": "clear"}, *server.ops]
+    assert counters["bytes_response_wire"] == counters["bytes_response"]
@@ -0,0 +1,62 @@
+import json
+
+import fixtures
+import pytest
+from rember import puller_cookie_replicache
+from rember import user_files as user_files_
+
+
+def test_cookie_reported_after_commit(user_files):
+    cookies_reported = []
+    cookies_replicache = puller_cookie_replicache.CookieReplicache(
+        user_files=user_files, callback_set=cookies_reported.append
+    )
+
+    with pytest.raises(RuntimeError):
+        with user_files.transaction():
+            cookies_replicache.set(1)
+            raise RuntimeError("Page failed")
+    assert cookies_reported == []
+    assert cookies_replicache.get() is None
+
+    with user_files.transaction():
+        cookies_replicache.set(2)
+        assert cookies_reported == []
+    assert cookies_reported == [2]
+
+    cookies_replicache.set(3)
+    assert cookies_reported == [2, 3]
+
+
+class StorageFailing(user_files_.StorageSqlite):
+    def save(self, data, writes):
+        raise RuntimeError("Disk full")
+
+
+def test_save_failed(tmp_path):
+    _user_files = user_files_.UserFiles(
+        storage=StorageFailing(str(tmp_path / "data.sqlite"))
+    )
+
+    with pytest.raises(RuntimeError):
+        _user_files.set("User/u0", {"email": "u0@rember.com"})
+    with pytest.raises(RuntimeError):
+        with _user_files.transaction():
+            _user_files.set("User/u1", {"email": "u1@rember.com"})
+
+    assert _user_files.get_all() == {}
+    assert _user_files.get_prefix("User/") == {}
+
+
+def test_migrate_data_json(tmp_path):
+    path_data_json = tmp_path / "data.json"
+    data = {"cookie_replicache": 3, "User/u0": {"email": "u0@rember.com"}}
+    path_data_json.write_text(json.dumps(data))
+    _user_files = fixtures.make_user_files(str(tmp_path))
+
+    _user_files._migrate_data_json(str(path_data_json))
+
+    assert _user_files.get_all() == data
+    assert fixtures.make_user_files(str(tmp_path)).get_all() == data
+    # A previous version of the add-on still finds its data after a downgrade
+    assert json.loads(path_data_json.read_text()) == data